@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 {
     'name': 'براندات - إدارة المنتجات والمبيعات',
-    'version': '1.0',
+    'version': '1.2',
     'summary': 'نظام متكامل لإدارة المنتجات والمخزون والمبيعات',
     'sequence': 10,
     'description': """
@@ -32,6 +32,9 @@
         'security/ir.model.access.csv',
         'data/sequence.xml',
         'data/dashboard_data.xml',
+        'data/company_settings_data.xml',
+        'data/cron.xml',
+        'data/stock_data.xml',
         'views/menu.xml',
         'views/dashboard_view.xml',
         'views/store_view.xml',
@@ -43,6 +46,7 @@
         'views/partner_view.xml',
         'views/employee_view.xml',
         'views/sale_view.xml',
+        'views/invoice_dispatch_view.xml',
         'views/sale_return_view.xml',
         'views/treasury_view.xml',         
         'views/transaction_view.xml',      
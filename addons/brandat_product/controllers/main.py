@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from werkzeug.wsgi import wrap_file
+
+from odoo import http
+from odoo.http import request, content_disposition
+
+
+class BrandatReportController(http.Controller):
+
+    @http.route('/brandat/profit_loss/export/<int:report_id>/<string:file_format>', type='http', auth='user')
+    def export_profit_loss(self, report_id, file_format):
+        """تحميل تقرير الأرباح والخسائر - الملف يرسل من القرص دون تحميله في الذاكرة"""
+        report = request.env['brandat.account.report'].browse(report_id).exists()
+        if not report or file_format not in ('csv', 'xlsx'):
+            raise request.not_found()
+
+        output, filename, mimetype = report._export_profit_loss(file_format)
+        return request.make_response(
+            wrap_file(request.httprequest.environ, output),
+            headers=[
+                ('Content-Type', mimetype),
+                ('Content-Disposition', content_disposition(filename)),
+            ],
+        )
+
+    @http.route('/brandat/sale/print_batch/<int:wizard_id>', type='http', auth='user')
+    def print_invoices_batch(self, wizard_id):
+        """تحميل الفواتير المطبوعة على دفعات كملف PDF واحد أو ملف ZIP"""
+        wizard = request.env['brandat.sale.print.batch'].browse(wizard_id).exists()
+        if not wizard:
+            raise request.not_found()
+
+        output, filename, mimetype = wizard._export_invoices()
+        return request.make_response(
+            wrap_file(request.httprequest.environ, output),
+            headers=[
+                ('Content-Type', mimetype),
+                ('Content-Disposition', content_disposition(filename)),
+            ],
+        )
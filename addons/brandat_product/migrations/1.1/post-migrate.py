@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    # تعبئة جدول الحقائق من الفواتير والمرتجعات الموجودة
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['brandat.sales.report']._refresh_facts()
+
+    # تهيئة الأرصدة الجارية للخزائن
+    env['brandat.treasury'].search([])._reconcile_totals()
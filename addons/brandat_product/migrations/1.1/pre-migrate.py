@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def _merge_duplicate_stock_rows(cr):
+    """دمج سجلات المخزون المكررة لنفس (الفرع، المنتج، المقاس، اللون) قبل إضافة القيد الفريد
+
+    الكمية تجمع في السجل صاحب أقل id، والمراجع للسجلات المحذوفة تنقل إليه
+    """
+    cr.execute("""
+        CREATE TEMPORARY TABLE brandat_stock_duplicates ON COMMIT DROP AS
+        SELECT id, keep_id
+        FROM (
+            SELECT id, MIN(id) OVER (PARTITION BY store_id, product_id, size_id, color_id) AS keep_id
+            FROM brandat_stock
+        ) s
+        WHERE id != keep_id
+    """)
+    if not cr.rowcount:
+        return
+    _logger.warning('Merging %s duplicate brandat_stock rows', cr.rowcount)
+
+    cr.execute("""
+        UPDATE brandat_stock s
+        SET quantity = COALESCE(s.quantity, 0) + d.quantity,
+            write_date = (now() at time zone 'UTC')
+        FROM (
+            SELECT dup.keep_id, SUM(COALESCE(st.quantity, 0)) AS quantity
+            FROM brandat_stock_duplicates dup
+            JOIN brandat_stock st ON st.id = dup.id
+            GROUP BY dup.keep_id
+        ) d
+        WHERE s.id = d.keep_id
+    """)
+
+    # نقل كل المفاتيح الأجنبية التي تشير للسجلات المكررة
+    cr.execute("""
+        SELECT cl.relname, att.attname
+        FROM pg_constraint con
+        JOIN pg_class cl ON cl.oid = con.conrelid
+        JOIN pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = con.conkey[1]
+        WHERE con.contype = 'f'
+          AND con.confrelid = 'brandat_stock'::regclass
+    """)
+    for table, column in cr.fetchall():
+        cr.execute(f"""
+            UPDATE "{table}" t
+            SET "{column}" = dup.keep_id
+            FROM brandat_stock_duplicates dup
+            WHERE t."{column}" = dup.id
+        """)
+
+    cr.execute("DELETE FROM brandat_stock WHERE id IN (SELECT id FROM brandat_stock_duplicates)")
+
+
+def migrate(cr, version):
+    # brandat_sales_report كان view وأصبح جدول حقائق مجمع
+    cr.execute("DROP VIEW IF EXISTS brandat_sales_report")
+
+    # القيد الفريد على المخزون لا يضاف إذا وجدت سجلات مكررة
+    _merge_duplicate_stock_rows(cr)
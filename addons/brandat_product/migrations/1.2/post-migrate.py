@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    # إنشاء سجل الولاء من الفواتير المؤكدة والمرتجعات المكتملة وبناء الأرصدة منه
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['brandat.loyalty.ledger']._seed_from_history()
+
+    # تهيئة إحصائيات الموظفين التي أصبحت تحدث بالفرق
+    env['brandat.employee']._rebuild_statistics()
+
+    # لقطة أولى من المخزون الحالي كنقطة بداية لسجل حركات المخزون
+    env['brandat.stock.snapshot']._create_snapshot()
@@ -3,12 +3,18 @@ from . import product
 from . import size
 from . import color
 from . import stock
+from . import stock_move
+from . import stock_velocity
 from . import sale
 from . import sale_line
 from . import report
+from . import loyalty
 from . import partner
+from . import purchase_import
 from . import stock_advanced
+from . import stock_rebalance
 from . import sale_print
+from . import invoice_dispatch
 from . import sale_return
 from . import dashboard
 from . import employee
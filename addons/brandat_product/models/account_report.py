@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api
 from datetime import datetime, timedelta
+import csv
+import io
+import tempfile
+
+# عدد الصفوف المكتوبة في كل دفعة عند التصدير
+PROFIT_LOSS_EXPORT_CHUNK = 1000
 
 class BrandatAccountReport(models.TransientModel):
     _name = 'brandat.account.report'
@@ -19,6 +25,15 @@ class BrandatAccountReport(models.TransientModel):
         ('expenses', 'تقرير المصروفات'),
     ], string='نوع التقرير', required=True, default='profit_loss')
     
+    # تفصيل الأرباح والخسائر
+    breakdown_by_store = fields.Boolean(string='تفصيل حسب الفرع')
+    breakdown_period = fields.Selection([
+        ('none', 'بدون'),
+        ('day', 'يومي'),
+        ('week', 'أسبوعي'),
+        ('month', 'شهري'),
+    ], string='تفصيل حسب الفترة', default='none', required=True)
+    
     def action_print_report(self):
         """طباعة التقرير"""
         if self.report_type == 'profit_loss':
@@ -30,36 +45,84 @@ class BrandatAccountReport(models.TransientModel):
         elif self.report_type == 'expenses':
             return self.env.ref('brandat_product.action_report_expenses').report_action(self)
     
-    def get_profit_loss_data(self):
-        """حساب الأرباح والخسائر"""
-        domain = [
-            ('date', '>=', self.date_from),
-            ('date', '<=', self.date_to),
-            ('state', '=', 'confirmed'),
-        ]
+    def _execute_profit_loss_query(self):
+        """تجميع المبيعات والمشتريات والمصروفات في مرور واحد حسب الفرع و/أو الفترة"""
+        self.env['brandat.sale'].flush_model(['date', 'state', 'store_id', 'amount_total'])
+        self.env['brandat.purchase'].flush_model(['date', 'state', 'store_id', 'amount_total'])
+        self.env['brandat.expense'].flush_model(['date', 'state', 'store_id', 'amount'])
         
-        if self.store_id:
-            domain.append(('store_id', '=', self.store_id.id))
+        store_column = "f.store_id" if self.breakdown_by_store else "NULL::int"
+        period_column = "NULL::date"
+        if self.breakdown_period != 'none':
+            period_column = "date_trunc(%(period)s, f.date)::date"
         
-        # المبيعات
-        sales = self.env['brandat.sale'].search(domain)
-        total_sales = sum(sales.mapped('amount_total'))
+        store_filter = ""
+        params = {
+            'datetime_from': datetime.combine(self.date_from, datetime.min.time()),
+            'datetime_to': datetime.combine(self.date_to + timedelta(days=1), datetime.min.time()),
+            'date_from': self.date_from,
+            'date_to': self.date_to,
+            'period': self.breakdown_period,
+        }
+        if self.store_id:
+            store_filter = "AND store_id = %(store_id)s"
+            params['store_id'] = self.store_id.id
         
-        # المشتريات (تكلفة البضاعة)
-        purchases = self.env['brandat.purchase'].search(domain)
-        total_purchases = sum(purchases.mapped('amount_total'))
+        self.env.cr.execute(f"""
+            SELECT {store_column} AS store_id,
+                   {period_column} AS period,
+                   SUM(f.sales), SUM(f.purchases), SUM(f.expenses)
+            FROM (
+                SELECT store_id, date, amount_total AS sales, 0.0 AS purchases, 0.0 AS expenses
+                FROM brandat_sale
+                WHERE state = 'confirmed' AND date >= %(datetime_from)s AND date < %(datetime_to)s {store_filter}
+                UNION ALL
+                SELECT store_id, date, 0.0, amount_total, 0.0
+                FROM brandat_purchase
+                WHERE state = 'confirmed' AND date >= %(datetime_from)s AND date < %(datetime_to)s {store_filter}
+                UNION ALL
+                SELECT store_id, date::timestamp, 0.0, 0.0, amount
+                FROM brandat_expense
+                WHERE state = 'paid' AND date >= %(date_from)s AND date <= %(date_to)s {store_filter}
+            ) f
+            GROUP BY 1, 2
+            ORDER BY 2, 1
+        """, params)
+    
+    def _iter_profit_loss_rows(self):
+        """صفوف التفصيل على دفعات بدلاً من تحميلها كلها في الذاكرة"""
+        # أسماء الفروع تجلب مسبقاً لأن أي استعلام آخر على نفس الـ cursor يلغي النتائج المعلقة
+        store_names = {}
+        if self.breakdown_by_store:
+            stores = self.env['brandat.store'].search([])
+            store_names = dict(zip(stores.ids, stores.mapped('name')))
         
-        # المصروفات
-        expense_domain = [
-            ('date', '>=', self.date_from),
-            ('date', '<=', self.date_to),
-            ('state', '=', 'paid'),
-        ]
-        if self.store_id:
-            expense_domain.append(('store_id', '=', self.store_id.id))
+        self._execute_profit_loss_query()
+        rows = self.env.cr.fetchmany(PROFIT_LOSS_EXPORT_CHUNK)
+        while rows:
+            chunk = []
+            for store_id, period, sales, purchases, expenses in rows:
+                gross_profit = sales - purchases
+                chunk.append({
+                    'store_id': store_id,
+                    'store_name': store_names.get(store_id, 'بدون فرع') if self.breakdown_by_store else '',
+                    'period': period,
+                    'total_sales': sales,
+                    'total_purchases': purchases,
+                    'total_expenses': expenses,
+                    'gross_profit': gross_profit,
+                    'net_profit': gross_profit - expenses,
+                })
+            yield chunk
+            rows = self.env.cr.fetchmany(PROFIT_LOSS_EXPORT_CHUNK)
+    
+    def get_profit_loss_data(self):
+        """حساب الأرباح والخسائر من مجاميع قاعدة البيانات"""
+        breakdown = [row for chunk in self._iter_profit_loss_rows() for row in chunk]
         
-        expenses = self.env['brandat.expense'].search(expense_domain)
-        total_expenses = sum(expenses.mapped('amount'))
+        total_sales = sum(row['total_sales'] for row in breakdown)              # المبيعات
+        total_purchases = sum(row['total_purchases'] for row in breakdown)      # المشتريات (تكلفة البضاعة)
+        total_expenses = sum(row['total_expenses'] for row in breakdown)        # المصروفات
         
         # الحسابات
         gross_profit = total_sales - total_purchases  # الربح الإجمالي
@@ -76,6 +139,70 @@ class BrandatAccountReport(models.TransientModel):
             'date_from': self.date_from,
             'date_to': self.date_to,
             'store_name': self.store_id.name if self.store_id else 'جميع الفروع',
+            'breakdown': breakdown if (self.breakdown_by_store or self.breakdown_period != 'none') else [],
+        }
+    
+    def _get_profit_loss_export_header(self):
+        return ['الفرع', 'الفترة', 'المبيعات', 'المشتريات', 'المصروفات', 'الربح الإجمالي', 'الربح الصافي']
+    
+    def _profit_loss_export_values(self, row):
+        return [
+            row['store_name'],
+            row['period'].strftime('%Y-%m-%d') if row['period'] else '',
+            row['total_sales'],
+            row['total_purchases'],
+            row['total_expenses'],
+            row['gross_profit'],
+            row['net_profit'],
+        ]
+    
+    def _export_profit_loss(self, file_format):
+        """كتابة التقرير في ملف مؤقت على دفعات - يرجع (الملف، الاسم، نوع المحتوى)"""
+        self.ensure_one()
+        output = tempfile.TemporaryFile()
+        filename = f'الأرباح_والخسائر_{self.date_from}_{self.date_to}.{file_format}'
+        
+        if file_format == 'xlsx':
+            import xlsxwriter
+            # constant_memory: كل صف يكتب على القرص فور اكتماله
+            workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'in_memory': False})
+            sheet = workbook.add_worksheet('الأرباح والخسائر')
+            sheet.right_to_left()
+            sheet.write_row(0, 0, self._get_profit_loss_export_header())
+            row_index = 1
+            for chunk in self._iter_profit_loss_rows():
+                for row in chunk:
+                    sheet.write_row(row_index, 0, self._profit_loss_export_values(row))
+                    row_index += 1
+            workbook.close()
+            mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        else:
+            text_output = io.TextIOWrapper(output, encoding='utf-8-sig', newline='')
+            writer = csv.writer(text_output)
+            writer.writerow(self._get_profit_loss_export_header())
+            for chunk in self._iter_profit_loss_rows():
+                writer.writerows(self._profit_loss_export_values(row) for row in chunk)
+            text_output.flush()
+            text_output.detach()
+            mimetype = 'text/csv'
+        
+        output.seek(0)
+        return output, filename, mimetype
+    
+    def action_export_profit_loss_csv(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/brandat/profit_loss/export/{self.id}/csv',
+            'target': 'self',
+        }
+    
+    def action_export_profit_loss_xlsx(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/brandat/profit_loss/export/{self.id}/xlsx',
+            'target': 'self',
         }
     
     def get_treasury_data(self):
@@ -104,63 +231,101 @@ class BrandatAccountReport(models.TransientModel):
         
         return data
     
+    # فترات أعمار الديون بالأيام (من، إلى)
+    AGEING_BUCKETS = [
+        ('0_30', 0, 30),
+        ('31_60', 31, 60),
+        ('61_90', 61, 90),
+        ('90_plus', 91, None),
+    ]
+    
+    def _get_partner_debts(self, partner_table, partner_column, document_table, payment_type, as_of):
+        """ديون العملاء أو الموردين باستعلام تجميعي واحد مع تقسيم أعمار الديون"""
+        bucket_sums = []
+        for key, start, end in self.AGEING_BUCKETS:
+            conditions = []
+            if start:
+                conditions.append(f"%(as_of)s - d.date::date >= {start}")
+            if end is not None:
+                conditions.append(f"%(as_of)s - d.date::date <= {end}")
+            bucket_sums.append(f"SUM(d.amount_total) FILTER (WHERE {' AND '.join(conditions)}) AS bucket_{key}")
+        bucket_sums = ",\n".join(bucket_sums)
+        self.env.cr.execute(f"""
+            WITH documents AS (
+                SELECT d.{partner_column} AS partner_id,
+                       SUM(d.amount_total) AS total,
+                       {bucket_sums}
+                FROM {document_table} d
+                WHERE d.state = 'confirmed' AND d.{partner_column} IS NOT NULL
+                GROUP BY d.{partner_column}
+            ),
+            payments AS (
+                SELECT p.{partner_column} AS partner_id, SUM(p.amount) AS total
+                FROM brandat_payment p
+                WHERE p.state = 'confirmed'
+                  AND p.payment_type = %(payment_type)s
+                  AND p.{partner_column} IS NOT NULL
+                GROUP BY p.{partner_column}
+            )
+            SELECT partner.name, partner.phone,
+                   COALESCE(doc.total, 0), COALESCE(pay.total, 0),
+                   {", ".join(f"COALESCE(doc.bucket_{key}, 0)" for key, _start, _end in self.AGEING_BUCKETS)}
+            FROM {partner_table} partner
+            LEFT JOIN documents doc ON doc.partner_id = partner.id
+            LEFT JOIN payments pay ON pay.partner_id = partner.id
+            WHERE partner.active
+              AND COALESCE(doc.total, 0) - COALESCE(pay.total, 0) > 0
+            ORDER BY partner.name
+        """, {'as_of': as_of, 'payment_type': payment_type})
+        
+        rows = []
+        for name, phone, total, paid, *buckets in self.env.cr.fetchall():
+            # توزيع المدفوعات على الفواتير الأقدم أولاً (FIFO)
+            ageing = dict(zip([key for key, _start, _end in self.AGEING_BUCKETS], buckets))
+            remaining = paid
+            for key, _start, _end in reversed(self.AGEING_BUCKETS):
+                allocated = min(ageing[key], remaining)
+                ageing[key] -= allocated
+                remaining -= allocated
+            rows.append({
+                'name': name,
+                'phone': phone,
+                'total': total,
+                'total_payments': paid,
+                'debt': total - paid,
+                'ageing': ageing,
+            })
+        return rows
+    
     def get_debts_data(self):
-        """تقرير الديون"""
+        """تقرير الديون - استعلامان تجميعيان للعملاء والموردين"""
+        as_of = fields.Date.today()
+        
+        self.env['brandat.sale'].flush_model(['customer_id', 'state', 'date', 'amount_total'])
+        self.env['brandat.purchase'].flush_model(['supplier_id', 'state', 'date', 'amount_total'])
+        self.env['brandat.payment'].flush_model(['customer_id', 'supplier_id', 'payment_type', 'state', 'amount'])
+        
         # ديون العملاء
-        customers = self.env['brandat.customer'].search([])
-        customer_debts = []
-        
-        for customer in customers:
-            sales = customer.sale_ids.filtered(lambda s: s.state == 'confirmed')
-            total_sales = sum(sales.mapped('amount_total'))
-            
-            payments = self.env['brandat.payment'].search([
-                ('customer_id', '=', customer.id),
-                ('payment_type', '=', 'customer'),
-                ('state', '=', 'confirmed'),
-            ])
-            total_payments = sum(payments.mapped('amount'))
-            
-            debt = total_sales - total_payments
-            
-            if debt > 0:
-                customer_debts.append({
-                    'name': customer.name,
-                    'phone': customer.phone,
-                    'total_sales': total_sales,
-                    'total_payments': total_payments,
-                    'debt': debt,
-                })
+        customer_debts = self._get_partner_debts(
+            'brandat_customer', 'customer_id', 'brandat_sale', 'customer', as_of)
+        for debt in customer_debts:
+            debt['total_sales'] = debt.pop('total')
         
         # ديون الموردين
-        suppliers = self.env['brandat.supplier'].search([])
-        supplier_debts = []
-        
-        for supplier in suppliers:
-            purchases = supplier.purchase_ids.filtered(lambda p: p.state == 'confirmed')
-            total_purchases = sum(purchases.mapped('amount_total'))
-            
-            payments = self.env['brandat.payment'].search([
-                ('supplier_id', '=', supplier.id),
-                ('payment_type', '=', 'supplier'),
-                ('state', '=', 'confirmed'),
-            ])
-            total_payments = sum(payments.mapped('amount'))
-            
-            debt = total_purchases - total_payments
-            
-            if debt > 0:
-                supplier_debts.append({
-                    'name': supplier.name,
-                    'phone': supplier.phone,
-                    'total_purchases': total_purchases,
-                    'total_payments': total_payments,
-                    'debt': debt,
-                })
+        supplier_debts = self._get_partner_debts(
+            'brandat_supplier', 'supplier_id', 'brandat_purchase', 'supplier', as_of)
+        for debt in supplier_debts:
+            debt['total_purchases'] = debt.pop('total')
         
         return {
             'customer_debts': customer_debts,
             'supplier_debts': supplier_debts,
             'total_customer_debts': sum([d['debt'] for d in customer_debts]),
             'total_supplier_debts': sum([d['debt'] for d in supplier_debts]),
-        }
\ No newline at end of file
+            'customer_ageing': {
+                key: sum(d['ageing'][key] for d in customer_debts) for key, _start, _end in self.AGEING_BUCKETS
+            },
+            'supplier_ageing': {
+                key: sum(d['ageing'][key] for d in supplier_debts) for key, _start, _end in self.AGEING_BUCKETS
+            },
+        }
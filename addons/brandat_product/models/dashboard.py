@@ -1,6 +1,13 @@
 from odoo import models, fields, api
+from odoo.tools import SQL
 from datetime import datetime, timedelta
 from collections import defaultdict
+import time
+
+# كاش مؤشرات لوحة التحكم على مستوى العملية: {(قاعدة البيانات، الشركة، المستخدم، التاريخ): (وقت الحساب، القيم)}
+# المستخدم جزء من المفتاح لأن القيم تحسب حسب قواعد الصلاحيات (الكاشير يرى فواتيره فقط)
+_KPI_CACHE = {}
+KPI_CACHE_TTL = 60  # ثانية
 
 class BrandatDashboard(models.Model):
     _name = 'brandat.dashboard'
@@ -9,19 +16,19 @@ class BrandatDashboard(models.Model):
     name = fields.Char(string='Dashboard', default='Brandat Dashboard')
     
     # مبيعات اليوم
-    today_sales = fields.Float(string='مبيعات اليوم', compute='_compute_today_sales')
-    today_sales_count = fields.Integer(string='عدد فواتير اليوم', compute='_compute_today_sales')
+    today_sales = fields.Float(string='مبيعات اليوم', compute='_compute_kpis')
+    today_sales_count = fields.Integer(string='عدد فواتير اليوم', compute='_compute_kpis')
     
     # مبيعات الأسبوع
-    week_sales = fields.Float(string='مبيعات الأسبوع', compute='_compute_week_sales')
-    week_sales_count = fields.Integer(string='عدد فواتير الأسبوع', compute='_compute_week_sales')
+    week_sales = fields.Float(string='مبيعات الأسبوع', compute='_compute_kpis')
+    week_sales_count = fields.Integer(string='عدد فواتير الأسبوع', compute='_compute_kpis')
     
     # مبيعات الشهر
-    month_sales = fields.Float(string='مبيعات الشهر', compute='_compute_month_sales')
-    month_sales_count = fields.Integer(string='عدد فواتير الشهر', compute='_compute_month_sales')
+    month_sales = fields.Float(string='مبيعات الشهر', compute='_compute_kpis')
+    month_sales_count = fields.Integer(string='عدد فواتير الشهر', compute='_compute_kpis')
     
     # مقارنات
-    yesterday_sales = fields.Float(string='مبيعات أمس', compute='_compute_yesterday_sales')
+    yesterday_sales = fields.Float(string='مبيعات أمس', compute='_compute_kpis')
     sales_growth = fields.Float(string='نسبة النمو %', compute='_compute_sales_growth')
     
     # المخزون
@@ -29,35 +36,18 @@ class BrandatDashboard(models.Model):
     out_stock_count = fields.Integer(string='منتجات نفذت', compute='_compute_stock_alerts')
     
     # العملاء
-    new_customers_today = fields.Integer(string='عملاء جدد اليوم', compute='_compute_customers')
-    total_customers = fields.Integer(string='إجمالي العملاء', compute='_compute_customers')
+    new_customers_today = fields.Integer(string='عملاء جدد اليوم', compute='_compute_kpis')
+    total_customers = fields.Integer(string='إجمالي العملاء', compute='_compute_kpis')
     
     # المرتجعات
-    today_returns = fields.Integer(string='مرتجعات اليوم', compute='_compute_returns')
-    week_returns = fields.Integer(string='مرتجعات الأسبوع', compute='_compute_returns')
-    
-    @api.depends()
-    def _compute_today_sales(self):
-        for rec in self:
-            today = fields.Date.today()
-            sales = self.env['brandat.sale'].search([
-                ('date', '>=', datetime.combine(today, datetime.min.time())),
-                ('date', '<=', datetime.combine(today, datetime.max.time())),
-                ('state', '=', 'confirmed')
-            ])
-            rec.today_sales = sum(sales.mapped('amount_total'))
-            rec.today_sales_count = len(sales)
+    today_returns = fields.Integer(string='مرتجعات اليوم', compute='_compute_kpis')
+    week_returns = fields.Integer(string='مرتجعات الأسبوع', compute='_compute_kpis')
     
     @api.depends()
-    def _compute_yesterday_sales(self):
+    def _compute_kpis(self):
+        values = self._get_kpi_values()
         for rec in self:
-            yesterday = fields.Date.today() - timedelta(days=1)
-            sales = self.env['brandat.sale'].search([
-                ('date', '>=', datetime.combine(yesterday, datetime.min.time())),
-                ('date', '<=', datetime.combine(yesterday, datetime.max.time())),
-                ('state', '=', 'confirmed')
-            ])
-            rec.yesterday_sales = sum(sales.mapped('amount_total'))
+            rec.update(values)
     
     @api.depends('today_sales', 'yesterday_sales')
     def _compute_sales_growth(self):
@@ -68,158 +58,299 @@ class BrandatDashboard(models.Model):
                 rec.sales_growth = 100.0 if rec.today_sales > 0 else 0.0
     
     @api.depends()
-    def _compute_week_sales(self):
+    def _compute_stock_alerts(self):
+        counts = self._get_stock_state_counts()
         for rec in self:
-            week_start = fields.Date.today() - timedelta(days=7)
-            sales = self.env['brandat.sale'].search([
-                ('date', '>=', datetime.combine(week_start, datetime.min.time())),
-                ('state', '=', 'confirmed')
-            ])
-            rec.week_sales = sum(sales.mapped('amount_total'))
-            rec.week_sales_count = len(sales)
+            rec.low_stock_count = counts['low']
+            rec.out_stock_count = counts['out']
     
-    @api.depends()
-    def _compute_month_sales(self):
-        for rec in self:
-            month_start = fields.Date.today().replace(day=1)
-            sales = self.env['brandat.sale'].search([
-                ('date', '>=', datetime.combine(month_start, datetime.min.time())),
-                ('state', '=', 'confirmed')
-            ])
-            rec.month_sales = sum(sales.mapped('amount_total'))
-            rec.month_sales_count = len(sales)
+    @api.model
+    def _get_stock_state_counts(self, store_ids=None):
+        """عدد سجلات المخزون المنخفضة والنافذة من فهرس (state, store_id) بدون تحميل السجلات"""
+        domain = [('state', 'in', ('low', 'out'))]
+        if store_ids:
+            domain.append(('store_id', 'in', store_ids))
+        counts = {'low': 0, 'out': 0}
+        counts.update(self.env['brandat.stock']._read_group(domain, ['state'], ['__count']))
+        return counts
     
-    @api.depends()
-    def _compute_stock_alerts(self):
-        for rec in self:
-            stocks = self.env['brandat.stock'].search([])
-            rec.low_stock_count = len(stocks.filtered(lambda s: s.state == 'low'))
-            rec.out_stock_count = len(stocks.filtered(lambda s: s.state == 'out'))
+    @api.model
+    def get_stock_state_by_store(self):
+        """توزيع حالات المخزون على الفروع"""
+        by_store = {}
+        for store, state, count in self.env['brandat.stock']._read_group(
+                [], ['store_id', 'state'], ['__count'], order='store_id'):
+            row = by_store.setdefault(store.id, {
+                'id': store.id,
+                'name': store.name,
+                'available': 0,
+                'low': 0,
+                'out': 0,
+            })
+            if state:
+                row[state] = count
+        return list(by_store.values())
     
-    @api.depends()
-    def _compute_customers(self):
-        for rec in self:
-            today = fields.Date.today()
-            rec.new_customers_today = self.env['brandat.customer'].search_count([
-                ('create_date', '>=', datetime.combine(today, datetime.min.time())),
-                ('create_date', '<=', datetime.combine(today, datetime.max.time())),
-            ])
-            rec.total_customers = self.env['brandat.customer'].search_count([])
+    @api.model
+    def _get_kpi_values(self):
+        """مؤشرات المبيعات والعملاء والمرتجعات من الكاش أو باستعلام تجميعي واحد"""
+        today = fields.Date.today()
+        key = (self.env.cr.dbname, self.env.company.id, self.env.uid, today)
+        cached = _KPI_CACHE.get(key)
+        if cached and time.monotonic() - cached[0] < KPI_CACHE_TTL:
+            return dict(cached[1])
+        
+        values = self._query_kpi_values(today)
+        _KPI_CACHE[key] = (time.monotonic(), values)
+        return dict(values)
     
-    @api.depends()
-    def _compute_returns(self):
-        for rec in self:
-            today = fields.Date.today()
-            week_start = today - timedelta(days=7)
-            
-            rec.today_returns = self.env['brandat.sale.return'].search_count([
-                ('date', '>=', datetime.combine(today, datetime.min.time())),
-                ('date', '<=', datetime.combine(today, datetime.max.time())),
-            ])
-            
-            rec.week_returns = self.env['brandat.sale.return'].search_count([
-                ('date', '>=', datetime.combine(week_start, datetime.min.time())),
-            ])
-    
-    def get_sales_chart_data(self, period='week'):
-        """بيانات رسم المبيعات"""
-        if period == 'week':
-            days = 7
-        elif period == 'month':
-            days = 30
-        else:
-            days = 7
-        
-        data = []
-        labels = []
-        
-        for i in range(days - 1, -1, -1):
-            date = fields.Date.today() - timedelta(days=i)
-            sales = self.env['brandat.sale'].search([
-                ('date', '>=', datetime.combine(date, datetime.min.time())),
-                ('date', '<=', datetime.combine(date, datetime.max.time())),
-                ('state', '=', 'confirmed')
-            ])
-            
-            total = sum(sales.mapped('amount_total'))
-            data.append(total)
-            labels.append(date.strftime('%d/%m'))
-        
-        return {'labels': labels, 'data': data}
-    
-    def get_top_products(self, limit=10):
-        """أعلى المنتجات مبيعاً"""
-        month_start = fields.Date.today().replace(day=1)
+    @api.model
+    def _query_kpi_values(self, today):
+        """حساب كل المؤشرات بمجاميع مشروطة لكل فترة في استعلام واحد - مع تطبيق قواعد الصلاحيات"""
+        today_start = datetime.combine(today, datetime.min.time())
+        tomorrow_start = today_start + timedelta(days=1)
+        yesterday_start = today_start - timedelta(days=1)
+        week_start = today_start - timedelta(days=7)
+        month_start = datetime.combine(today.replace(day=1), datetime.min.time())
         
-        sale_lines = self.env['brandat.sale.line'].search([
-            ('sale_id.date', '>=', datetime.combine(month_start, datetime.min.time())),
-            ('sale_id.state', '=', 'confirmed')
-        ])
+        start = min(yesterday_start, week_start, month_start)
+        # _search يضيف قواعد الصلاحيات (ir.rule) كما كان البحث العادي يفعل
+        sales = self.env['brandat.sale']._search([('state', '=', 'confirmed'), ('date', '>=', start)])
+        customers = self.env['brandat.customer']._search([])
+        returns = self.env['brandat.sale.return']._search([('date', '>=', week_start)])
         
-        products = defaultdict(lambda: {'quantity': 0, 'amount': 0})
+        self.env['brandat.sale'].flush_model(['date', 'state', 'amount_total'])
+        self.env['brandat.customer'].flush_model(['active', 'create_date'])
+        self.env['brandat.sale.return'].flush_model(['date'])
+        self.env.cr.execute(SQL("""
+            SELECT
+                COALESCE(SUM(s.amount_total) FILTER (WHERE s.date >= %(today)s AND s.date < %(tomorrow)s), 0),
+                COUNT(*) FILTER (WHERE s.date >= %(today)s AND s.date < %(tomorrow)s),
+                COALESCE(SUM(s.amount_total) FILTER (WHERE s.date >= %(yesterday)s AND s.date < %(today)s), 0),
+                COALESCE(SUM(s.amount_total) FILTER (WHERE s.date >= %(week)s), 0),
+                COUNT(*) FILTER (WHERE s.date >= %(week)s),
+                COALESCE(SUM(s.amount_total) FILTER (WHERE s.date >= %(month)s), 0),
+                COUNT(*) FILTER (WHERE s.date >= %(month)s),
+                (SELECT COUNT(*) FROM brandat_customer c
+                  WHERE c.id IN %(customers)s AND c.create_date >= %(today)s AND c.create_date < %(tomorrow)s),
+                (SELECT COUNT(*) FROM brandat_customer c WHERE c.id IN %(customers)s),
+                (SELECT COUNT(*) FROM brandat_sale_return r
+                  WHERE r.id IN %(returns)s AND r.date >= %(today)s AND r.date < %(tomorrow)s),
+                (SELECT COUNT(*) FROM brandat_sale_return r WHERE r.id IN %(returns)s)
+            FROM brandat_sale s
+            WHERE s.id IN %(sales)s
+        """,
+            today=today_start,
+            tomorrow=tomorrow_start,
+            yesterday=yesterday_start,
+            week=week_start,
+            month=month_start,
+            sales=sales.subselect(),
+            customers=customers.subselect(),
+            returns=returns.subselect(),
+        ))
+        row = self.env.cr.fetchone()
+        return dict(zip([
+            'today_sales', 'today_sales_count', 'yesterday_sales',
+            'week_sales', 'week_sales_count', 'month_sales', 'month_sales_count',
+            'new_customers_today', 'total_customers', 'today_returns', 'week_returns',
+        ], row))
+    
+    @api.model
+    def _invalidate_kpi_cache(self):
+        """مسح كاش المؤشرات لقاعدة البيانات الحالية بعد الـ commit"""
+        dbname = self.env.cr.dbname
         
-        for line in sale_lines:
-            key = line.product_id.id
-            products[key]['name'] = line.product_id.name
-            products[key]['quantity'] += line.quantity
-            products[key]['amount'] += line.price_subtotal
+        def _clear():
+            for key in [key for key in _KPI_CACHE if key[0] == dbname]:
+                _KPI_CACHE.pop(key, None)
         
-        sorted_products = sorted(products.items(), key=lambda x: x[1]['amount'], reverse=True)[:limit]
+        self.env.cr.postcommit.add(_clear)
+    
+    # عدد الأيام لكل فترة في رسم المبيعات
+    CHART_PERIOD_DAYS = {
+        'week': 7,
+        'month': 30,
+        'quarter': 90,
+        'year': 365,
+    }
+    
+    def get_sales_chart_data(self, period='week', days=None, store_ids=None, by_store=False):
+        """بيانات رسم المبيعات - سلسلة يومية كاملة من استعلام تجميعي واحد
         
+        days: عدد أيام مخصص بدلاً من الفترة، store_ids: فلتر الفروع،
+        by_store: إضافة سلسلة لكل فرع
+        """
+        days = days or self.CHART_PERIOD_DAYS.get(period, 7)
+        today = fields.Date.today()
+        date_list = [today - timedelta(days=i) for i in range(days - 1, -1, -1)]
+        
+        query = """
+            SELECT s.date::date AS day, s.store_id, SUM(s.amount_total)
+            FROM brandat_sale s
+            WHERE s.state = 'confirmed'
+              AND s.date >= %(date_from)s
+              AND s.date < %(date_to)s
+        """
+        params = {
+            'date_from': datetime.combine(date_list[0], datetime.min.time()),
+            'date_to': datetime.combine(today + timedelta(days=1), datetime.min.time()),
+        }
+        if store_ids:
+            query += " AND s.store_id IN %(store_ids)s"
+            params['store_ids'] = tuple(store_ids)
+        query += " GROUP BY day, s.store_id"
+        
+        self.env['brandat.sale'].flush_model(['date', 'state', 'amount_total', 'store_id'])
+        self.env.cr.execute(query, params)
+        
+        totals = defaultdict(float)
+        store_totals = defaultdict(lambda: defaultdict(float))
+        for day, store_id, amount in self.env.cr.fetchall():
+            totals[day] += amount
+            store_totals[store_id][day] += amount
+        
+        result = {
+            'labels': [date.strftime('%d/%m') for date in date_list],
+            'data': [totals.get(date, 0.0) for date in date_list],
+        }
+        
+        if by_store:
+            stores = self.env['brandat.store'].browse(store_ids) if store_ids else self.env['brandat.store'].search([])
+            result['stores'] = [
+                {
+                    'id': store.id,
+                    'name': store.name,
+                    'data': [store_totals[store.id].get(date, 0.0) for date in date_list],
+                }
+                for store in stores
+            ]
+        
+        return result
+    
+    # أبعاد الترتيب على مستوى أسطر الفواتير: {البعد: (عمود السطر، جدول الاسم)}
+    LINE_RANKING_DIMENSIONS = {
+        'product': ('product_id', 'brandat_product'),
+        'size': ('size_id', 'brandat_size'),
+        'color': ('color_id', 'brandat_color'),
+    }
+    
+    def _get_sales_period_filter(self, date_from=None, date_to=None, store_ids=None):
+        """شروط الفترة والفروع للفواتير المؤكدة (الافتراضي: من أول الشهر)"""
+        date_from = date_from or fields.Date.today().replace(day=1)
+        clause = "s.state = 'confirmed' AND s.date >= %(date_from)s"
+        params = {'date_from': datetime.combine(fields.Date.to_date(date_from), datetime.min.time())}
+        if date_to:
+            clause += " AND s.date < %(date_to)s"
+            params['date_to'] = datetime.combine(fields.Date.to_date(date_to) + timedelta(days=1), datetime.min.time())
+        if store_ids:
+            clause += " AND s.store_id IN %(store_ids)s"
+            params['store_ids'] = tuple(store_ids)
+        return clause, params
+    
+    def _get_line_ranking(self, dimension, limit=10, date_from=None, date_to=None, store_ids=None):
+        """ترتيب المبيعات حسب المنتج أو المقاس أو اللون - التجميع والترتيب داخل قاعدة البيانات"""
+        column, name_table = self.LINE_RANKING_DIMENSIONS[dimension]
+        clause, params = self._get_sales_period_filter(date_from, date_to, store_ids)
+        params['limit'] = limit
+        
+        self.env['brandat.sale'].flush_model(['date', 'state', 'store_id'])
+        self.env['brandat.sale.line'].flush_model([column, 'sale_id', 'quantity', 'price_subtotal'])
+        self.env.cr.execute(f"""
+            SELECT d.id, d.name, SUM(sl.quantity) AS quantity, SUM(sl.price_subtotal) AS amount
+            FROM brandat_sale_line sl
+            JOIN brandat_sale s ON s.id = sl.sale_id
+            JOIN {name_table} d ON d.id = sl.{column}
+            WHERE {clause}
+            GROUP BY d.id, d.name
+            ORDER BY amount DESC, d.id
+            LIMIT %(limit)s
+        """, params)
         return [
-            {
-                'name': item[1]['name'],
-                'quantity': item[1]['quantity'],
-                'amount': item[1]['amount']
-            }
-            for item in sorted_products
+            {'id': res_id, 'name': name, 'quantity': quantity, 'amount': amount}
+            for res_id, name, quantity, amount in self.env.cr.fetchall()
         ]
     
-    def get_store_performance(self):
-        """أداء الفروع"""
-        month_start = fields.Date.today().replace(day=1)
-        
-        stores = self.env['brandat.store'].search([])
-        result = []
-        
-        for store in stores:
-            sales = self.env['brandat.sale'].search([
-                ('store_id', '=', store.id),
-                ('date', '>=', datetime.combine(month_start, datetime.min.time())),
-                ('state', '=', 'confirmed')
-            ])
-            
-            result.append({
-                'name': store.name,
-                'sales_count': len(sales),
-                'total_amount': sum(sales.mapped('amount_total'))
-            })
+    def get_top_products(self, limit=10, date_from=None, date_to=None, store_ids=None):
+        """أعلى المنتجات مبيعاً"""
+        return self._get_line_ranking('product', limit, date_from, date_to, store_ids)
+    
+    def get_top_sizes(self, limit=10, date_from=None, date_to=None, store_ids=None):
+        """أعلى المقاسات مبيعاً"""
+        return self._get_line_ranking('size', limit, date_from, date_to, store_ids)
+    
+    def get_top_colors(self, limit=10, date_from=None, date_to=None, store_ids=None):
+        """أعلى الألوان مبيعاً"""
+        return self._get_line_ranking('color', limit, date_from, date_to, store_ids)
+    
+    def get_top_employees(self, limit=10, date_from=None, date_to=None, store_ids=None):
+        """أعلى الموظفين مبيعاً"""
+        clause, params = self._get_sales_period_filter(date_from, date_to, store_ids)
+        params['limit'] = limit
         
-        return sorted(result, key=lambda x: x['total_amount'], reverse=True)
+        self.env['brandat.sale'].flush_model(['date', 'state', 'store_id', 'employee_id', 'amount_total'])
+        self.env.cr.execute(f"""
+            SELECT e.id, e.name, COUNT(s.id) AS sales_count, SUM(s.amount_total) AS total_amount
+            FROM brandat_sale s
+            JOIN brandat_employee e ON e.id = s.employee_id
+            WHERE {clause}
+            GROUP BY e.id, e.name
+            ORDER BY total_amount DESC, e.id
+            LIMIT %(limit)s
+        """, params)
+        return [
+            {'id': res_id, 'name': name, 'sales_count': sales_count, 'total_amount': total_amount}
+            for res_id, name, sales_count, total_amount in self.env.cr.fetchall()
+        ]
+    
+    def get_store_performance(self, limit=None, date_from=None, date_to=None, store_ids=None):
+        """أداء الفروع - كل الفروع النشطة حتى بدون مبيعات"""
+        clause, params = self._get_sales_period_filter(date_from, date_to)
+        params['limit'] = limit
+        store_clause = ""
+        if store_ids:
+            store_clause = "AND st.id IN %(store_ids)s"
+            params['store_ids'] = tuple(store_ids)
+        
+        self.env['brandat.store'].flush_model(['name', 'active'])
+        self.env['brandat.sale'].flush_model(['date', 'state', 'store_id', 'amount_total'])
+        self.env.cr.execute(f"""
+            SELECT st.id, st.name, COUNT(s.id) AS sales_count, COALESCE(SUM(s.amount_total), 0) AS total_amount
+            FROM brandat_store st
+            LEFT JOIN brandat_sale s ON s.store_id = st.id AND {clause}
+            WHERE st.active {store_clause}
+            GROUP BY st.id, st.name
+            ORDER BY total_amount DESC, st.id
+            LIMIT %(limit)s
+        """, params)
+        return [
+            {'id': res_id, 'name': name, 'sales_count': sales_count, 'total_amount': total_amount}
+            for res_id, name, sales_count, total_amount in self.env.cr.fetchall()
+        ]
     
     def get_alerts(self):
         """التنبيهات والإشعارات"""
         alerts = []
         
+        stock_counts = self._get_stock_state_counts()
+        
         # تنبيهات المخزون المنخفض
-        low_stocks = self.env['brandat.stock'].search([('state', '=', 'low')])
-        if low_stocks:
+        if stock_counts['low']:
             alerts.append({
                 'type': 'warning',
                 'icon': 'fa-exclamation-triangle',
                 'title': 'مخزون منخفض',
-                'message': f'{len(low_stocks)} منتج وصل للحد الأدنى',
+                'message': f"{stock_counts['low']} منتج وصل للحد الأدنى",
                 'action': 'brandat.stock'
             })
         
         # تنبيهات المخزون النافذ
-        out_stocks = self.env['brandat.stock'].search([('state', '=', 'out')])
-        if out_stocks:
+        if stock_counts['out']:
             alerts.append({
                 'type': 'danger',
                 'icon': 'fa-times-circle',
                 'title': 'مخزون نفذ',
-                'message': f'{len(out_stocks)} منتج نفذ من المخزون',
+                'message': f"{stock_counts['out']} منتج نفذ من المخزون",
                 'action': 'brandat.stock'
             })
         
@@ -1,4 +1,9 @@
 # -*- coding: utf-8 -*-
+from collections import defaultdict
+from datetime import timedelta
+
+from dateutil.relativedelta import relativedelta
+
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
 
@@ -42,9 +47,11 @@ class BrandatEmployee(models.Model):
     image = fields.Binary(string='الصورة')
     
     # الإحصائيات
-    total_sales = fields.Float(string='إجمالي المبيعات', compute='_compute_statistics', store=True)
-    total_commission = fields.Float(string='إجمالي العمولات', compute='_compute_statistics', store=True)
-    sale_count = fields.Integer(string='عدد الفواتير', compute='_compute_statistics', store=True)
+    # تحدث بالفرق عند تأكيد أو إلغاء فواتير الموظف
+    total_sales = fields.Float(string='إجمالي المبيعات', readonly=True)
+    total_commission = fields.Float(string='إجمالي العمولات', compute='_compute_commission', store=True)
+    sale_count = fields.Integer(string='عدد الفواتير', readonly=True)
+    commission_ids = fields.One2many('brandat.employee.commission', 'employee_id', string='العمولات الدورية')
     
     # ملاحظات
     notes = fields.Text(string='ملاحظات')
@@ -55,17 +62,66 @@ class BrandatEmployee(models.Model):
             vals['code'] = self.env['ir.sequence'].next_by_code('brandat.employee') or 'New'
         return super(BrandatEmployee, self).create(vals)
 
-    @api.depends('name')
-    def _compute_statistics(self):
+    @api.depends('total_sales', 'commission_rate')
+    def _compute_commission(self):
         for record in self:
-            sales = self.env['brandat.sale'].search([
-                ('employee_id', '=', record.id),
-                ('state', '=', 'confirmed')
-            ])
-            record.total_sales = sum(sales.mapped('amount_total'))
-            record.sale_count = len(sales)
             record.total_commission = record.total_sales * (record.commission_rate / 100)
 
+    @api.model
+    def _add_sales_totals(self, entries):
+        """تحديث إحصائيات الموظفين بالفرق - entries: قائمة (employee_id, المبلغ، عدد الفواتير)"""
+        deltas = defaultdict(lambda: [0.0, 0])
+        for employee_id, amount, count in entries:
+            if employee_id:
+                deltas[employee_id][0] += amount
+                deltas[employee_id][1] += count
+        if not deltas:
+            return
+
+        self.flush_model(['total_sales', 'sale_count'])
+        self.env.cr.execute("""
+            UPDATE brandat_employee e
+            SET total_sales = COALESCE(e.total_sales, 0) + v.amount,
+                sale_count = COALESCE(e.sale_count, 0) + v.count
+            FROM unnest(%s::int[], %s::float8[], %s::int[]) AS v(id, amount, count)
+            WHERE e.id = v.id
+        """, [
+            list(deltas),
+            [amount for amount, _count in deltas.values()],
+            [count for _amount, count in deltas.values()],
+        ])
+        self.browse(deltas)._statistics_updated()
+
+    def _statistics_updated(self):
+        """تحديث الكاش وإعادة حساب العمولة بعد التعديل المباشر"""
+        self.invalidate_recordset(['total_sales', 'sale_count'])
+        self.modified(['total_sales', 'sale_count'])
+
+    @api.model
+    def _rebuild_statistics(self):
+        """إعادة حساب إحصائيات كل الموظفين من الفواتير المؤكدة باستعلام تجميعي واحد"""
+        self.env['brandat.sale'].flush_model(['employee_id', 'state', 'amount_total'])
+        self.flush_model(['total_sales', 'sale_count'])
+        self.env.cr.execute("""
+            WITH stats AS (
+                SELECT e.id,
+                       COALESCE(SUM(s.amount_total), 0) AS total_sales,
+                       COUNT(s.id) AS sale_count
+                FROM brandat_employee e
+                LEFT JOIN brandat_sale s ON s.employee_id = e.id AND s.state = 'confirmed'
+                GROUP BY e.id
+            )
+            UPDATE brandat_employee e
+            SET total_sales = stats.total_sales,
+                sale_count = stats.sale_count
+            FROM stats
+            WHERE e.id = stats.id
+              AND (e.total_sales IS DISTINCT FROM stats.total_sales
+                   OR e.sale_count IS DISTINCT FROM stats.sale_count)
+            RETURNING e.id
+        """)
+        self.browse(row[0] for row in self.env.cr.fetchall())._statistics_updated()
+
     def action_view_sales(self):
         return {
             'name': 'مبيعات الموظف',
@@ -83,6 +139,148 @@ class BrandatEmployee(models.Model):
                 raise ValidationError('نسبة العمولة يجب أن تكون بين 0 و 100')
 
 
+# عمولات الموظفين لكل فترة (يومي / شهري)
+class BrandatEmployeeCommission(models.Model):
+    _name = 'brandat.employee.commission'
+    _description = 'Brandat Employee Commission Snapshot'
+    _order = 'period_start desc, employee_id'
+
+    employee_id = fields.Many2one('brandat.employee', string='الموظف', required=True, ondelete='cascade')
+    store_id = fields.Many2one(related='employee_id.store_id', string='الفرع', store=True)
+    period_type = fields.Selection([
+        ('day', 'يومي'),
+        ('month', 'شهري'),
+    ], string='نوع الفترة', required=True)
+    period_start = fields.Date(string='بداية الفترة', required=True)
+    sale_count = fields.Integer(string='عدد الفواتير')
+    total_sales = fields.Float(string='إجمالي المبيعات')
+    commission_rate = fields.Float(string='نسبة العمولة (%)')
+    commission = fields.Float(string='العمولة')
+
+    _sql_constraints = [
+        ('employee_period_unique', 'unique(employee_id, period_type, period_start)',
+         'يوجد سجل عمولة بالفعل لهذا الموظف في نفس الفترة!')
+    ]
+
+    @api.model
+    def _compute_snapshots(self, period_type, date_from, date_to):
+        """حساب مبيعات وعمولات كل الموظفين لكل فترة بين التاريخين باستعلام تجميعي واحد"""
+        assert period_type in ('day', 'month')
+        self.env['brandat.sale'].flush_model(['employee_id', 'state', 'amount_total', 'date'])
+        self.env['brandat.employee'].flush_model(['commission_rate'])
+        self.flush_model()
+
+        params = {
+            'period_type': period_type,
+            'date_from': date_from,
+            'date_to': date_to + timedelta(days=1),
+            'uid': self.env.uid,
+        }
+        # حذف فترات لم يعد للموظف فيها مبيعات (مثلاً بعد إلغاء فاتورة)
+        self.env.cr.execute("""
+            DELETE FROM brandat_employee_commission
+            WHERE period_type = %(period_type)s
+              AND period_start >= date_trunc(%(period_type)s, %(date_from)s::timestamp)::date
+              AND period_start < %(date_to)s
+        """, params)
+        self.env.cr.execute("""
+            INSERT INTO brandat_employee_commission (
+                employee_id, store_id, period_type, period_start,
+                sale_count, total_sales, commission_rate, commission,
+                create_uid, create_date, write_uid, write_date
+            )
+            SELECT e.id, e.store_id, %(period_type)s, date_trunc(%(period_type)s, s.date)::date,
+                   COUNT(*), SUM(s.amount_total), e.commission_rate,
+                   SUM(s.amount_total) * COALESCE(e.commission_rate, 0) / 100,
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+            FROM brandat_sale s
+            JOIN brandat_employee e ON e.id = s.employee_id
+            WHERE s.state = 'confirmed'
+              AND s.date >= date_trunc(%(period_type)s, %(date_from)s::timestamp)
+              AND s.date < %(date_to)s
+            GROUP BY e.id, e.store_id, e.commission_rate, date_trunc(%(period_type)s, s.date)
+        """, params)
+        self.invalidate_model()
+
+    @api.model
+    def _refresh_employee_periods(self, entries):
+        """إعادة حساب فترات (الموظف، اليوم/الشهر) المتأثرة فقط بعد تأكيد أو إلغاء فواتير
+
+        entries: قائمة (employee_id، تاريخ الفاتورة) - تستدعى مع _add_sales_totals
+        """
+        entries = [(employee_id, fields.Date.to_date(date)) for employee_id, date in entries if employee_id and date]
+        if not entries:
+            return
+        self._refresh_periods('day', {(employee_id, date) for employee_id, date in entries})
+        self._refresh_periods('month', {(employee_id, date.replace(day=1)) for employee_id, date in entries})
+
+    @api.model
+    def _refresh_periods(self, period_type, keys):
+        """إعادة حساب سجلات عمولة محددة - keys: مجموعة (employee_id، بداية الفترة)"""
+        assert period_type in ('day', 'month')
+        self.env['brandat.sale'].flush_model(['employee_id', 'state', 'amount_total', 'date'])
+        self.env['brandat.employee'].flush_model(['commission_rate'])
+        self.flush_model()
+
+        starts = [period_start for _employee_id, period_start in keys]
+        last_start = max(starts)
+        params = {
+            'period_type': period_type,
+            'keys': tuple(sorted(keys)),
+            'date_from': min(starts),
+            'date_to': last_start + (timedelta(days=1) if period_type == 'day'
+                                     else relativedelta(months=1)),
+            'uid': self.env.uid,
+        }
+        self.env.cr.execute("""
+            INSERT INTO brandat_employee_commission AS c (
+                employee_id, store_id, period_type, period_start,
+                sale_count, total_sales, commission_rate, commission,
+                create_uid, create_date, write_uid, write_date
+            )
+            SELECT e.id, e.store_id, %(period_type)s, date_trunc(%(period_type)s, s.date)::date,
+                   COUNT(*), SUM(s.amount_total), e.commission_rate,
+                   SUM(s.amount_total) * COALESCE(e.commission_rate, 0) / 100,
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+            FROM brandat_sale s
+            JOIN brandat_employee e ON e.id = s.employee_id
+            WHERE s.state = 'confirmed'
+              AND s.date >= %(date_from)s AND s.date < %(date_to)s
+              AND (s.employee_id, date_trunc(%(period_type)s, s.date)::date) IN %(keys)s
+            GROUP BY e.id, e.store_id, e.commission_rate, date_trunc(%(period_type)s, s.date)
+            ORDER BY e.id, date_trunc(%(period_type)s, s.date)
+            ON CONFLICT (employee_id, period_type, period_start) DO UPDATE SET
+                store_id = EXCLUDED.store_id,
+                sale_count = EXCLUDED.sale_count,
+                total_sales = EXCLUDED.total_sales,
+                commission_rate = EXCLUDED.commission_rate,
+                commission = EXCLUDED.commission,
+                write_uid = EXCLUDED.write_uid,
+                write_date = EXCLUDED.write_date
+            RETURNING c.employee_id, c.period_start
+        """, params)
+        remaining = keys - {(employee_id, period_start) for employee_id, period_start in self.env.cr.fetchall()}
+
+        # فترات لم يعد للموظف فيها مبيعات مؤكدة (مثلاً بعد إلغاء آخر فاتورة)
+        if remaining:
+            self.env.cr.execute("""
+                DELETE FROM brandat_employee_commission
+                WHERE period_type = %s AND (employee_id, period_start) IN %s
+            """, [period_type, tuple(sorted(remaining))])
+        self.invalidate_model()
+
+    @api.model
+    def _cron_compute_snapshots(self):
+        """مهمة يومية: عمولات أمس واليوم، وعمولات الشهر الحالي والسابق
+
+        الفترات الأقدم تحدث مباشرة عند تأكيد أو إلغاء الفواتير (_refresh_employee_periods)
+        """
+        today = fields.Date.today()
+        self._compute_snapshots('day', today - timedelta(days=1), today)
+        previous_month = (today.replace(day=1) - timedelta(days=1)).replace(day=1)
+        self._compute_snapshots('month', previous_month, today)
+
+
 # سجل الحضور والانصراف
 class BrandatAttendance(models.Model):
     _name = 'brandat.attendance'
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import models, fields, api
+from odoo.exceptions import ValidationError
+
+_logger = logging.getLogger(__name__)
+
+# عدد الفواتير التي يتم تجهيزها وإرسالها في كل تشغيل للمهمة
+DISPATCH_BATCH_SIZE = 50
+
+
+class BrandatInvoiceDispatch(models.Model):
+    _name = 'brandat.invoice.dispatch'
+    _description = 'Invoice Bulk Dispatch'
+    _order = 'id desc'
+
+    name = fields.Char(string='رقم الإرسال', default='New', readonly=True)
+    channel = fields.Selection([
+        ('email', 'البريد الإلكتروني'),
+        ('whatsapp', 'واتساب'),
+    ], string='القناة', required=True, readonly=True)
+    state = fields.Selection([
+        ('in_progress', 'جاري الإرسال'),
+        ('done', 'تم'),
+    ], string='الحالة', default='in_progress', readonly=True)
+    line_ids = fields.One2many('brandat.invoice.dispatch.line', 'dispatch_id', string='الفواتير', readonly=True)
+
+    total_count = fields.Integer(string='عدد الفواتير', compute='_compute_counts')
+    sent_count = fields.Integer(string='تم الإرسال', compute='_compute_counts')
+    failed_count = fields.Integer(string='فشل', compute='_compute_counts')
+    pending_count = fields.Integer(string='في الانتظار', compute='_compute_counts')
+
+    @api.depends('line_ids.state')
+    def _compute_counts(self):
+        counts = {
+            (dispatch.id, state): count
+            for dispatch, state, count in self.env['brandat.invoice.dispatch.line']._read_group(
+                [('dispatch_id', 'in', self.ids)], ['dispatch_id', 'state'], ['__count'],
+            )
+        }
+        for dispatch in self:
+            dispatch.sent_count = counts.get((dispatch.id, 'sent'), 0)
+            dispatch.failed_count = counts.get((dispatch.id, 'failed'), 0)
+            dispatch.pending_count = counts.get((dispatch.id, 'pending'), 0)
+            dispatch.total_count = dispatch.sent_count + dispatch.failed_count + dispatch.pending_count
+
+    @api.model
+    def _create_dispatch(self, sales, channel):
+        """إنشاء سجل إرسال للفواتير المؤكدة المحددة"""
+        sales = sales.filtered(lambda s: s.state == 'confirmed')
+        if not sales:
+            raise ValidationError('يجب تحديد فواتير مؤكدة للإرسال!')
+
+        dispatch = self.create({
+            'name': self.env['ir.sequence'].next_by_code('brandat.invoice.dispatch') or 'New',
+            'channel': channel,
+        })
+        if channel == 'whatsapp':
+            dispatch._prepare_whatsapp(sales)
+        else:
+            dispatch._prepare_email(sales)
+        return dispatch
+
+    def _prepare_email(self, sales):
+        """تسجيل الفواتير في سجل الإرسال وتشغيل المهمة في الخلفية"""
+        Line = self.env['brandat.invoice.dispatch.line']
+        vals_list = []
+        for sale in sales:
+            email = sale._get_customer_email()
+            vals_list.append({
+                'dispatch_id': self.id,
+                'sale_id': sale.id,
+                'recipient': email,
+                'state': 'pending' if email else 'failed',
+                'error': False if email else 'لا يوجد بريد إلكتروني للعميل!',
+            })
+        Line.create(vals_list)
+        self.invalidate_recordset(['pending_count'])
+        if self.pending_count:
+            self.state = 'in_progress'
+            self.env.ref('brandat_product.ir_cron_process_invoice_dispatches')._trigger()
+        else:
+            self.state = 'done'
+
+    def _prepare_whatsapp(self, sales):
+        """تجهيز كل روابط واتساب في مرور واحد (لا يوجد ملف PDF لإنشائه)"""
+        settings = self.env['brandat.company.settings'].get_settings()
+        vals_list = []
+        notes = []
+        for sale in sales:
+            try:
+                mobile, url = sale._get_whatsapp_link(settings)
+            except ValidationError as e:
+                vals_list.append({
+                    'dispatch_id': self.id,
+                    'sale_id': sale.id,
+                    'state': 'failed',
+                    'error': str(e),
+                })
+                continue
+            vals_list.append({
+                'dispatch_id': self.id,
+                'sale_id': sale.id,
+                'recipient': mobile,
+                'whatsapp_url': url,
+                'state': 'sent',
+            })
+            notes.append(sale._get_dispatch_note_values(f'تم تجهيز رابط واتساب للفاتورة إلى {mobile}'))
+        self.env['brandat.invoice.dispatch.line'].create(vals_list)
+        self.env['mail.message'].create(notes)
+        self.state = 'done'
+
+    def _process_email_batch(self, limit=DISPATCH_BATCH_SIZE):
+        """تجهيز ملفات PDF وإضافة الرسائل لطابور البريد لدفعة من الفواتير"""
+        lines = self.env['brandat.invoice.dispatch.line'].search([
+            ('dispatch_id', 'in', self.ids),
+            ('state', '=', 'pending'),
+        ], limit=limit)
+        template = self.env.ref('brandat_product.email_template_brandat_sale')
+        # ملفات الدفعة كلها باستدعاء تقرير واحد (الفواتير التي لم تتغير تؤخذ من الملف المحفوظ)
+        rendered = lines.sale_id._render_invoice_pdf_batch()
+        notes = []
+        for line in lines:
+            try:
+                with self.env.cr.savepoint():
+                    if not rendered:
+                        line.sale_id._render_invoice_pdf()
+                    template.send_mail(line.sale_id.id, email_values={
+                        'attachment_ids': [(4, line.sale_id.invoice_pdf_id.id)],
+                    })
+                    line.state = 'sent'
+            except Exception as e:
+                _logger.exception('Failed to dispatch invoice %s', line.sale_id.name)
+                line.write({'state': 'failed', 'error': str(e)})
+            else:
+                notes.append(line.sale_id._get_dispatch_note_values(
+                    f'تم إرسال الفاتورة بالبريد الإلكتروني إلى {line.recipient}'))
+        self.env['mail.message'].create(notes)
+        return lines
+
+    @api.model
+    def _cron_process_dispatches(self):
+        """مهمة الخلفية: معالجة دفعة من كل عمليات الإرسال الجارية"""
+        dispatches = self.search([('state', '=', 'in_progress'), ('channel', '=', 'email')])
+        lines = dispatches._process_email_batch()
+
+        dispatches.invalidate_recordset(['pending_count'])
+        dispatches.filtered(lambda d: not d.pending_count).state = 'done'
+        if len(lines) == DISPATCH_BATCH_SIZE:
+            self.env.ref('brandat_product.ir_cron_process_invoice_dispatches')._trigger()
+
+    def action_retry_failed(self):
+        """إعادة محاولة الفواتير التي فشل إرسالها"""
+        for dispatch in self:
+            failed = dispatch.line_ids.filtered(lambda l: l.state == 'failed')
+            sales = failed.sale_id
+            failed.unlink()
+            if dispatch.channel == 'whatsapp':
+                dispatch._prepare_whatsapp(sales)
+            else:
+                dispatch._prepare_email(sales)
+
+    def _get_action(self):
+        self.ensure_one()
+        return {
+            'name': 'إرسال الفواتير',
+            'type': 'ir.actions.act_window',
+            'res_model': 'brandat.invoice.dispatch',
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'current',
+        }
+
+
+class BrandatInvoiceDispatchLine(models.Model):
+    _name = 'brandat.invoice.dispatch.line'
+    _description = 'Invoice Bulk Dispatch Line'
+    _order = 'id'
+
+    dispatch_id = fields.Many2one('brandat.invoice.dispatch', string='الإرسال', required=True,
+                                  ondelete='cascade', index=True)
+    sale_id = fields.Many2one('brandat.sale', string='الفاتورة', required=True, ondelete='cascade')
+    customer_id = fields.Many2one(related='sale_id.customer_id', string='العميل')
+    recipient = fields.Char(string='المستلم')
+    whatsapp_url = fields.Char(string='رابط واتساب')
+    state = fields.Selection([
+        ('pending', 'في الانتظار'),
+        ('sent', 'تم الإرسال'),
+        ('failed', 'فشل'),
+    ], string='الحالة', default='pending', required=True, index=True)
+    error = fields.Text(string='الخطأ')
+
+    def action_open_whatsapp(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': self.whatsapp_url,
+            'target': 'new',
+        }
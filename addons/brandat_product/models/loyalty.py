@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import logging
+from collections import defaultdict
+
+from odoo import models, fields, api
+from odoo.exceptions import ValidationError
+
+_logger = logging.getLogger(__name__)
+
+# كل 100 جنيه = 1 نقطة
+LOYALTY_POINT_VALUE = 100.0
+
+
+class BrandatLoyaltyLedger(models.Model):
+    _name = 'brandat.loyalty.ledger'
+    _description = 'Customer Loyalty Ledger'
+    _order = 'date desc, id desc'
+
+    customer_id = fields.Many2one('brandat.customer', string='العميل', required=True, index=True, ondelete='cascade')
+    date = fields.Datetime(string='التاريخ', default=fields.Datetime.now, required=True)
+    move_type = fields.Selection([
+        ('sale', 'فاتورة بيع'),
+        ('cancel', 'إلغاء فاتورة'),
+        ('return', 'مرتجع'),
+        ('adjust', 'تسوية'),
+    ], string='نوع الحركة', required=True)
+    sale_id = fields.Many2one('brandat.sale', string='الفاتورة', index=True, ondelete='set null')
+    return_id = fields.Many2one('brandat.sale.return', string='المرتجع', ondelete='set null')
+    amount = fields.Float(string='المشتريات')
+    points = fields.Float(string='النقاط')
+
+    def write(self, vals):
+        raise ValidationError('لا يمكن تعديل حركات سجل الولاء، يجب إضافة حركة تسوية!')
+
+    def unlink(self):
+        raise ValidationError('لا يمكن حذف حركات سجل الولاء، يجب إضافة حركة تسوية!')
+
+    @api.model
+    def _post_entries(self, vals_list):
+        """إضافة حركات للسجل وتحديث الأرصدة الجارية للعملاء بالفرق فقط"""
+        vals_list = [vals for vals in vals_list if vals.get('amount') or vals.get('points')]
+        if not vals_list:
+            return self.browse()
+
+        entries = self.create(vals_list)
+
+        deltas = defaultdict(lambda: [0.0, 0.0])
+        for vals in vals_list:
+            deltas[vals['customer_id']][0] += vals.get('amount', 0.0)
+            deltas[vals['customer_id']][1] += vals.get('points', 0.0)
+
+        Customer = self.env['brandat.customer']
+        Customer.flush_model(['total_purchases', 'loyalty_points'])
+        self.env.cr.execute("""
+            UPDATE brandat_customer c
+            SET total_purchases = COALESCE(c.total_purchases, 0) + v.amount,
+                loyalty_points = COALESCE(c.loyalty_points, 0) + v.points
+            FROM unnest(%s::int[], %s::float8[], %s::float8[]) AS v(id, amount, points)
+            WHERE c.id = v.id
+        """, [
+            list(deltas),
+            [amount for amount, _points in deltas.values()],
+            [points for _amount, points in deltas.values()],
+        ])
+        customers = Customer.browse(deltas)
+        customers.invalidate_recordset(['total_purchases', 'loyalty_points'])
+        customers.modified(['total_purchases', 'loyalty_points'])
+        return entries
+
+    @api.model
+    def _rebuild_balances(self):
+        """التحقق من الأرصدة الجارية وإعادة بنائها من السجل باستعلام تجميعي واحد
+
+        يرجع عدد العملاء الذين تم تصحيح أرصدتهم
+        """
+        self.flush_model()
+        self.env['brandat.customer'].flush_model(['total_purchases', 'loyalty_points'])
+        self.env.cr.execute("""
+            WITH balances AS (
+                SELECT c.id,
+                       COALESCE(SUM(l.amount), 0) AS amount,
+                       COALESCE(SUM(l.points), 0) AS points
+                FROM brandat_customer c
+                LEFT JOIN brandat_loyalty_ledger l ON l.customer_id = c.id
+                GROUP BY c.id
+            )
+            UPDATE brandat_customer c
+            SET total_purchases = b.amount,
+                loyalty_points = b.points
+            FROM balances b
+            WHERE c.id = b.id
+              AND (ROUND(COALESCE(c.total_purchases, 0)::numeric, 2) != ROUND(b.amount::numeric, 2)
+                   OR ROUND(COALESCE(c.loyalty_points, 0)::numeric, 2) != ROUND(b.points::numeric, 2))
+            RETURNING c.id
+        """)
+        fixed_ids = [row[0] for row in self.env.cr.fetchall()]
+        if fixed_ids:
+            _logger.warning('Rebuilt loyalty balances for %s customers: %s', len(fixed_ids), fixed_ids[:20])
+            customers = self.env['brandat.customer'].browse(fixed_ids)
+            customers.invalidate_recordset(['total_purchases', 'loyalty_points'])
+            customers.modified(['total_purchases', 'loyalty_points'])
+        return len(fixed_ids)
+
+    @api.model
+    def _seed_from_history(self):
+        """إنشاء حركات السجل من الفواتير المؤكدة والمرتجعات المكتملة (مرة واحدة عند الترقية)"""
+        self.env['brandat.sale'].flush_model()
+        self.env['brandat.sale.return'].flush_model()
+        self.env.cr.execute("""
+            INSERT INTO brandat_loyalty_ledger (
+                customer_id, date, move_type, sale_id, return_id, amount, points,
+                create_uid, create_date, write_uid, write_date
+            )
+            SELECT s.customer_id, s.date, 'sale', s.id, NULL, s.amount_total,
+                   s.amount_total / %(point_value)s - COALESCE(s.loyalty_points_used, 0),
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+            FROM brandat_sale s
+            WHERE s.state = 'confirmed' AND s.customer_id IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM brandat_loyalty_ledger l WHERE l.sale_id = s.id)
+            UNION ALL
+            SELECT r.customer_id, r.date, 'return', r.sale_id, r.id, r.difference_amount,
+                   r.difference_amount / %(point_value)s,
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+            FROM brandat_sale_return r
+            WHERE r.state = 'done' AND r.customer_id IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM brandat_loyalty_ledger l WHERE l.return_id = r.id)
+        """, {'point_value': LOYALTY_POINT_VALUE, 'uid': self.env.uid})
+        self.invalidate_model()
+        return self._rebuild_balances()
+
+    @api.model
+    def _cron_verify_balances(self):
+        """مهمة التحقق اليومية من أرصدة الولاء"""
+        self._rebuild_balances()
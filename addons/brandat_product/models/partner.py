@@ -21,15 +21,17 @@ class BrandatCustomer(models.Model):
     ], string='نوع العميل', default='regular', required=True, tracking=True)
     
     # نقاط الولاء
-    loyalty_points = fields.Float(string='نقاط الولاء', compute='_compute_loyalty_points', store=True)
-    total_purchases = fields.Float(string='إجمالي المشتريات', compute='_compute_total_purchases', store=True)
+    # أرصدة جارية تحدث بالفرق من سجل الولاء (brandat.loyalty.ledger)
+    loyalty_points = fields.Float(string='نقاط الولاء', readonly=True)
+    total_purchases = fields.Float(string='إجمالي المشتريات', readonly=True)
     purchase_count = fields.Integer(string='عدد الفواتير', compute='_compute_purchase_count')
     
     # الخصومات
     discount_percentage = fields.Float(string='نسبة الخصم %', default=0.0)
     
     # العلاقات
-    sale_ids = fields.One2many('brandat.sale', 'partner_id', string='الفواتير')
+    sale_ids = fields.One2many('brandat.sale', 'customer_id', string='الفواتير')
+    loyalty_ledger_ids = fields.One2many('brandat.loyalty.ledger', 'customer_id', string='سجل الولاء')
     
     # الحالة
     active = fields.Boolean(string='نشط', default=True)
@@ -41,18 +43,6 @@ class BrandatCustomer(models.Model):
             vals['code'] = self.env['ir.sequence'].next_by_code('brandat.customer') or 'New'
         return super().create(vals)
     
-    @api.depends('sale_ids.amount_total', 'sale_ids.state')
-    def _compute_total_purchases(self):
-        for customer in self:
-            confirmed_sales = customer.sale_ids.filtered(lambda s: s.state == 'confirmed')
-            customer.total_purchases = sum(confirmed_sales.mapped('amount_total'))
-    
-    @api.depends('total_purchases')
-    def _compute_loyalty_points(self):
-        # كل 100 جنيه = 1 نقطة
-        for customer in self:
-            customer.loyalty_points = customer.total_purchases / 100
-    
     def _compute_purchase_count(self):
         for customer in self:
             customer.purchase_count = len(customer.sale_ids.filtered(lambda s: s.state == 'confirmed'))
@@ -64,8 +54,8 @@ class BrandatCustomer(models.Model):
             'type': 'ir.actions.act_window',
             'res_model': 'brandat.sale',
             'view_mode': 'list,form',
-            'domain': [('partner_id', '=', self.id)],
-            'context': {'default_partner_id': self.id}
+            'domain': [('customer_id', '=', self.id)],
+            'context': {'default_customer_id': self.id}
         }
 
 
@@ -155,11 +145,12 @@ class BrandatPurchase(models.Model):
         for purchase in self:
             purchase.amount_total = sum(line.price_subtotal for line in purchase.line_ids)
     
-    @api.model
-    def create(self, vals):
-        if vals.get('name', 'New') == 'New':
-            vals['name'] = self.env['ir.sequence'].next_by_code('brandat.purchase') or 'New'
-        return super().create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if vals.get('name', 'New') == 'New':
+                vals['name'] = self.env['ir.sequence'].next_by_code('brandat.purchase') or 'New'
+        return super().create(vals_list)
     
     def action_confirm(self):
         for purchase in self:
@@ -167,29 +158,21 @@ class BrandatPurchase(models.Model):
                 raise ValidationError('لا يمكن تأكيد فاتورة شراء بدون منتجات!')
             
             # إضافة المنتجات للمخزون
-            for line in purchase.line_ids:
-                stock = self.env['brandat.stock'].search([
-                    ('store_id', '=', purchase.store_id.id),
-                    ('product_id', '=', line.product_id.id),
-                    ('size_id', '=', line.size_id.id),
-                    ('color_id', '=', line.color_id.id),
-                ], limit=1)
-                
-                if stock:
-                    stock.quantity += line.quantity
-                else:
-                    self.env['brandat.stock'].create({
-                        'store_id': purchase.store_id.id,
-                        'product_id': line.product_id.id,
-                        'size_id': line.size_id.id,
-                        'color_id': line.color_id.id,
-                        'quantity': line.quantity,
-                    })
+            self.env['brandat.stock']._apply_stock_moves([
+                (purchase.store_id.id, line.product_id.id, line.size_id.id, line.color_id.id, line.quantity)
+                for line in purchase.line_ids
+            ], move_type='purchase', origin=purchase)
             
             purchase.state = 'confirmed'
+        
+        self.env['brandat.treasury']._add_store_day_totals(
+            'total_purchases', [(purchase.store_id.id, purchase.date, purchase.amount_total) for purchase in self])
     
     def action_cancel(self):
+        confirmed = self.filtered(lambda p: p.state == 'confirmed')
         self.state = 'cancel'
+        self.env['brandat.treasury']._add_store_day_totals(
+            'total_purchases', [(purchase.store_id.id, purchase.date, -purchase.amount_total) for purchase in confirmed])
     
     def action_draft(self):
         self.state = 'draft'
@@ -197,7 +180,9 @@ class BrandatPurchase(models.Model):
 
 class BrandatPurchaseLine(models.Model):
     _name = 'brandat.purchase.line'
+    _inherit = ['brandat.stock.availability.mixin']
     _description = 'Brandat Purchase Line'
+    _stock_availability_store_field = 'purchase_id.store_id'
     
     purchase_id = fields.Many2one('brandat.purchase', string='فاتورة الشراء', ondelete='cascade', required=True)
     product_id = fields.Many2one('brandat.product', string='المنتج', required=True)
@@ -206,12 +191,15 @@ class BrandatPurchaseLine(models.Model):
     quantity = fields.Integer(string='الكمية', default=1, required=True)
     price_unit = fields.Float(string='سعر الوحدة', required=True)
     price_subtotal = fields.Float(string='الإجمالي', compute='_compute_subtotal', store=True)
+    # إعادة تسمية فقط لحقل المتاح المحسوب في brandat.stock.availability.mixin: المخزون الحالي في فرع الاستلام
+    available_qty = fields.Integer(string='المخزون الحالي')
     
     @api.depends('quantity', 'price_unit')
     def _compute_subtotal(self):
         for line in self:
             line.price_subtotal = line.quantity * line.price_unit
     
+    
     @api.onchange('product_id')
     def _onchange_product_id(self):
         if self.product_id:
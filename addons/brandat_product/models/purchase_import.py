@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import base64
+import csv
+import io
+
+from odoo import models, fields, api
+from odoo.exceptions import ValidationError
+
+# عدد الأسطر المنشأة في كل دفعة عند استيراد فاتورة شراء
+PURCHASE_IMPORT_BATCH_SIZE = 1000
+
+# أقصى عدد من الأخطاء يعرض للمستخدم
+PURCHASE_IMPORT_MAX_ERRORS = 20
+
+
+def _cell_text(cell):
+    """قيمة الخلية كنص - الأرقام الصحيحة في XLSX تقرأ 123.0 فتحول إلى 123"""
+    if cell is None:
+        return ''
+    if isinstance(cell, float) and cell.is_integer():
+        cell = int(cell)
+    return str(cell).strip()
+
+
+class BrandatPurchaseImport(models.TransientModel):
+    _name = 'brandat.purchase.import'
+    _description = 'Purchase Receipt Import'
+
+    file = fields.Binary(string='الملف', required=True,
+                         help='CSV أو XLSX بالأعمدة: كود المنتج، المقاس، اللون، الكمية، سعر الوحدة (اختياري)')
+    filename = fields.Char(string='اسم الملف')
+    supplier_id = fields.Many2one('brandat.supplier', string='المورد', required=True)
+    store_id = fields.Many2one('brandat.store', string='الفرع', required=True)
+    date = fields.Datetime(string='تاريخ الفاتورة', default=fields.Datetime.now, required=True)
+    confirm = fields.Boolean(string='تأكيد الفاتورة وإضافة المخزون مباشرة')
+
+    def _iter_file_rows(self):
+        """قراءة صفوف الملف صفاً بصف (بدون صف العناوين) - يرجع (رقم الصف، القيم)"""
+        content = io.BytesIO(base64.b64decode(self.file))
+        if (self.filename or '').lower().endswith('.xlsx'):
+            import openpyxl
+            # read_only: الصفوف تقرأ من الملف عند الطلب بدلاً من تحميل الورقة كلها
+            workbook = openpyxl.load_workbook(content, read_only=True, data_only=True)
+            try:
+                yield from enumerate(workbook.active.iter_rows(min_row=2, values_only=True), start=2)
+            finally:
+                workbook.close()
+        else:
+            reader = csv.reader(io.TextIOWrapper(content, encoding='utf-8-sig', newline=''))
+            next(reader, None)
+            yield from enumerate(reader, start=2)
+
+    def _iter_row_chunks(self):
+        """تجميع الصفوف غير الفارغة في دفعات"""
+        chunk = []
+        for index, row in self._iter_file_rows():
+            if not any(cell not in (None, '') for cell in row):
+                continue
+            chunk.append((index, row))
+            if len(chunk) == PURCHASE_IMPORT_BATCH_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    @api.model
+    def _resolve_products(self, references, products):
+        """البحث عن المنتجات الجديدة في الدفعة بالكود ثم بالاسم - products: كاش {المرجع: (id، السعر)}"""
+        missing = list({ref for ref in references if ref not in products})
+        if not missing:
+            return
+        Product = self.env['brandat.product']
+        for field_name in ('code', 'name'):
+            for product in Product.search_read([(field_name, 'in', missing)], [field_name, 'price']):
+                products.setdefault(product[field_name], (product['id'], product['price']))
+            missing = [ref for ref in missing if ref not in products]
+            if not missing:
+                return
+
+    def _prepare_line_values(self, purchase, chunk, products, sizes, colors, errors):
+        """تحويل صفوف الدفعة إلى قيم أسطر فاتورة الشراء مع تسجيل الأخطاء"""
+        rows = []
+        for index, row in chunk:
+            reference, size, color, quantity, price = ([_cell_text(cell) for cell in row] + [''] * 5)[:5]
+            rows.append((index, reference, size, color, quantity, price))
+        self._resolve_products([row[1] for row in rows], products)
+
+        vals_list = []
+        for index, reference, size, color, quantity, price in rows:
+            if reference not in products:
+                errors.append(f'سطر {index}: المنتج "{reference}" غير موجود')
+                continue
+            if size not in sizes:
+                errors.append(f'سطر {index}: المقاس "{size}" غير موجود')
+                continue
+            if color not in colors:
+                errors.append(f'سطر {index}: اللون "{color}" غير موجود')
+                continue
+            try:
+                quantity = int(float(quantity))
+                price = float(price) if price else products[reference][1]
+            except ValueError:
+                errors.append(f'سطر {index}: الكمية أو السعر غير صحيح')
+                continue
+            if quantity <= 0:
+                errors.append(f'سطر {index}: الكمية يجب أن تكون أكبر من صفر')
+                continue
+            vals_list.append({
+                'purchase_id': purchase.id,
+                'product_id': products[reference][0],
+                'size_id': sizes[size],
+                'color_id': colors[color],
+                'quantity': quantity,
+                'price_unit': price,
+            })
+        return vals_list
+
+    def action_import(self):
+        """إنشاء فاتورة الشراء وأسطرها على دفعات أثناء قراءة الملف"""
+        self.ensure_one()
+        purchase = self.env['brandat.purchase'].create({
+            'supplier_id': self.supplier_id.id,
+            'store_id': self.store_id.id,
+            'date': self.date,
+            'notes': f'مستوردة من الملف {self.filename or ""}',
+        })
+
+        # المقاسات والألوان جداول صغيرة فتحمل مرة واحدة، والمنتجات تحمل مع كل دفعة
+        sizes = {size['name']: size['id'] for size in self.env['brandat.size'].search_read([], ['name'])}
+        colors = {color['name']: color['id'] for color in self.env['brandat.color'].search_read([], ['name'])}
+        products = {}
+        errors = []
+        line_count = 0
+
+        Line = self.env['brandat.purchase.line']
+        for chunk in self._iter_row_chunks():
+            vals_list = self._prepare_line_values(purchase, chunk, products, sizes, colors, errors)
+            if errors:
+                # لا فائدة من إنشاء باقي الأسطر، سيتم إلغاء الاستيراد كله
+                continue
+            Line.create(vals_list)
+            line_count += len(vals_list)
+
+        if errors:
+            message = 'لا يمكن استيراد الملف:\n' + '\n'.join(errors[:PURCHASE_IMPORT_MAX_ERRORS])
+            if len(errors) > PURCHASE_IMPORT_MAX_ERRORS:
+                message += f'\n... و {len(errors) - PURCHASE_IMPORT_MAX_ERRORS} أخطاء أخرى'
+            raise ValidationError(message)
+        if not line_count:
+            raise ValidationError('الملف لا يحتوي على أي منتجات!')
+
+        if self.confirm:
+            purchase.action_confirm()
+
+        return {
+            'name': 'فاتورة الشراء',
+            'type': 'ir.actions.act_window',
+            'res_model': 'brandat.purchase',
+            'res_id': purchase.id,
+            'view_mode': 'form',
+            'target': 'current',
+        }
@@ -4,43 +4,189 @@ from datetime import datetime, timedelta
 class BrandatSalesReport(models.Model):
     _name = 'brandat.sales.report'
     _description = 'Sales Report'
-    _auto = False
     _order = 'date desc'
+    _log_access = False
     
+    # جدول حقائق يومي مجمع حسب (التاريخ، الفرع، المنتج، المقاس، اللون)
+    # يتم تحديثه بالفرق فقط عند تأكيد/إلغاء الفواتير وإكمال المرتجعات، ويعاد بناؤه كاملاً ليلياً للتسوية
     date = fields.Date(string='التاريخ', readonly=True)
     store_id = fields.Many2one('brandat.store', string='الفرع', readonly=True)
-    product_id = fields.Many2one('brandat.product', string='المنتج', readonly=True)
+    product_id = fields.Many2one('brandat.product', string='المنتج', readonly=True, index=True)
     size_id = fields.Many2one('brandat.size', string='المقاس', readonly=True)
     color_id = fields.Many2one('brandat.color', string='اللون', readonly=True)
     quantity = fields.Integer(string='الكمية المباعة', readonly=True)
-    price_unit = fields.Float(string='سعر الوحدة', readonly=True)
+    price_unit = fields.Float(string='متوسط سعر الوحدة', readonly=True, aggregator='avg')
     price_total = fields.Float(string='الإجمالي', readonly=True)
+    return_quantity = fields.Integer(string='الكمية المرتجعة', readonly=True)
+    return_amount = fields.Float(string='مبلغ المرتجعات', readonly=True)
+    net_total = fields.Float(string='صافي المبيعات', readonly=True)
     state = fields.Selection([
         ('draft', 'مسودة'),
         ('confirmed', 'مؤكدة'),
         ('cancel', 'ملغية')
-    ], string='الحالة', readonly=True)
+    ], string='الحالة', readonly=True, default='confirmed')
+    
+    _sql_constraints = [
+        ('fact_key_unique', 'unique(date, store_id, product_id, size_id, color_id)',
+         'يوجد سطر مجمع بالفعل لهذا اليوم والفرع والمنتج!')
+    ]
     
     def init(self):
-        tools.drop_view_if_exists(self.env.cr, self._table)
+        tools.create_index(self.env.cr, 'brandat_sales_report_store_date_index', self._table, ['store_id', 'date'])
+    
+    @api.model
+    def _apply_fact_deltas(self, sale_ids=(), return_ids=(), sign=1):
+        """إضافة أسطر الفواتير والمرتجعات المحددة فقط للجدول بالفرق (sign=-1 للإلغاء)
+
+        جملة upsert واحدة مرتبة حسب المفتاح حتى لا تتعارض الأقفال بين الكاشيرات في نفس الفرع واليوم
+        """
+        sale_ids, return_ids = tuple(sale_ids), tuple(return_ids)
+        if not sale_ids and not return_ids:
+            return
+        
+        self.env['brandat.sale'].flush_model(['date', 'store_id'])
+        self.env['brandat.sale.line'].flush_model(['sale_id', 'product_id', 'size_id', 'color_id', 'quantity', 'price_subtotal'])
+        self.env['brandat.sale.return'].flush_model(['date', 'store_id'])
+        self.env['brandat.sale.return.line'].flush_model(['return_id', 'product_id', 'size_id', 'color_id', 'quantity_return', 'return_amount'])
+        
         self.env.cr.execute("""
-            CREATE OR REPLACE VIEW %s AS (
-                SELECT 
-                    sl.id as id,
-                    DATE(s.date) as date,
-                    s.store_id,
-                    sl.product_id,
-                    sl.size_id,
-                    sl.color_id,
-                    sl.quantity,
-                    sl.price_unit,
-                    sl.price_subtotal as price_total,
-                    s.state
+            INSERT INTO brandat_sales_report AS r (
+                date, store_id, product_id, size_id, color_id,
+                quantity, price_total, price_unit, return_quantity, return_amount, net_total, state
+            )
+            SELECT
+                f.date, f.store_id, f.product_id, f.size_id, f.color_id,
+                %(sign)s * SUM(f.quantity),
+                %(sign)s * SUM(f.price_total),
+                COALESCE(SUM(f.price_total) / NULLIF(SUM(f.quantity), 0), 0),
+                %(sign)s * SUM(f.return_quantity),
+                %(sign)s * SUM(f.return_amount),
+                %(sign)s * (SUM(f.price_total) - SUM(f.return_amount)),
+                'confirmed'
+            FROM (
+                SELECT s.date::date AS date, s.store_id, sl.product_id, sl.size_id, sl.color_id,
+                       sl.quantity, sl.price_subtotal AS price_total,
+                       0 AS return_quantity, 0.0 AS return_amount
                 FROM brandat_sale_line sl
-                JOIN brandat_sale s ON sl.sale_id = s.id
-                WHERE s.state = 'confirmed'
+                JOIN brandat_sale s ON s.id = sl.sale_id
+                WHERE sl.sale_id IN %(sale_ids)s
+                UNION ALL
+                SELECT rt.date::date, rt.store_id, rl.product_id, rl.size_id, rl.color_id,
+                       0, 0.0,
+                       rl.quantity_return, rl.return_amount
+                FROM brandat_sale_return_line rl
+                JOIN brandat_sale_return rt ON rt.id = rl.return_id
+                WHERE rl.return_id IN %(return_ids)s AND rl.quantity_return > 0
+            ) f
+            GROUP BY f.date, f.store_id, f.product_id, f.size_id, f.color_id
+            ORDER BY f.date, f.store_id, f.product_id, f.size_id, f.color_id
+            ON CONFLICT (date, store_id, product_id, size_id, color_id) DO UPDATE SET
+                quantity = r.quantity + EXCLUDED.quantity,
+                price_total = r.price_total + EXCLUDED.price_total,
+                price_unit = COALESCE((r.price_total + EXCLUDED.price_total)
+                                      / NULLIF(r.quantity + EXCLUDED.quantity, 0), 0),
+                return_quantity = r.return_quantity + EXCLUDED.return_quantity,
+                return_amount = r.return_amount + EXCLUDED.return_amount,
+                net_total = r.net_total + EXCLUDED.net_total
+            RETURNING r.id
+        """, {
+            'sign': sign,
+            'sale_ids': sale_ids or (0,),
+            'return_ids': return_ids or (0,),
+        })
+        fact_ids = [row[0] for row in self.env.cr.fetchall()]
+        
+        # حذف الأسطر التي أصبحت صفرية بعد الإلغاء
+        if fact_ids and sign < 0:
+            self.env.cr.execute("""
+                DELETE FROM brandat_sales_report
+                WHERE id IN %s
+                  AND quantity = 0 AND return_quantity = 0
+                  AND ROUND(price_total::numeric, 2) = 0 AND ROUND(return_amount::numeric, 2) = 0
+            """, [tuple(fact_ids)])
+        self.invalidate_model()
+    
+    @api.model
+    def _cron_rebuild_facts(self):
+        """تسوية ليلية: إعادة بناء الجدول كاملاً من الفواتير والمرتجعات"""
+        self._refresh_facts()
+    
+    @api.model
+    def _refresh_facts(self, keys=None):
+        """إعادة تجميع الأيام المتأثرة فقط: keys قائمة (التاريخ، الفرع)، وبدونها يعاد بناء الجدول كاملاً
+
+        للترقية والتسوية الليلية فقط، أما الفواتير والمرتجعات فتستخدم _apply_fact_deltas
+        """
+        if keys is not None:
+            keys = list({(fields.Date.to_date(date), store_id) for date, store_id in keys if date and store_id})
+            if not keys:
+                return
+        
+        self.env['brandat.sale'].flush_model(['date', 'store_id', 'state'])
+        self.env['brandat.sale.line'].flush_model(['sale_id', 'product_id', 'size_id', 'color_id', 'quantity', 'price_subtotal'])
+        self.env['brandat.sale.return'].flush_model(['date', 'store_id', 'state'])
+        self.env['brandat.sale.return.line'].flush_model(['return_id', 'product_id', 'size_id', 'color_id', 'quantity_return', 'return_amount'])
+        
+        params = {}
+        sale_filter = return_filter = ""
+        if keys is not None:
+            dates = [date for date, _store_id in keys]
+            params.update({
+                'keys': tuple(keys),
+                'date_from': datetime.combine(min(dates), datetime.min.time()),
+                'date_to': datetime.combine(max(dates) + timedelta(days=1), datetime.min.time()),
+            })
+            sale_filter = """
+                AND s.date >= %(date_from)s AND s.date < %(date_to)s
+                AND (s.date::date, s.store_id) IN %(keys)s
+            """
+            return_filter = """
+                AND r.date >= %(date_from)s AND r.date < %(date_to)s
+                AND (r.date::date, r.store_id) IN %(keys)s
+            """
+            self.env.cr.execute("DELETE FROM brandat_sales_report WHERE (date, store_id) IN %(keys)s", params)
+        else:
+            self.env.cr.execute("DELETE FROM brandat_sales_report")
+        
+        self.env.cr.execute(f"""
+            INSERT INTO brandat_sales_report (
+                date, store_id, product_id, size_id, color_id,
+                quantity, price_total, price_unit, return_quantity, return_amount, net_total, state
             )
-        """ % self._table)
+            SELECT
+                f.date, f.store_id, f.product_id, f.size_id, f.color_id,
+                SUM(f.quantity),
+                SUM(f.price_total),
+                COALESCE(SUM(f.price_total) / NULLIF(SUM(f.quantity), 0), 0),
+                SUM(f.return_quantity),
+                SUM(f.return_amount),
+                SUM(f.price_total) - SUM(f.return_amount),
+                'confirmed'
+            FROM (
+                SELECT s.date::date AS date, s.store_id, sl.product_id, sl.size_id, sl.color_id,
+                       sl.quantity, sl.price_subtotal AS price_total,
+                       0 AS return_quantity, 0.0 AS return_amount
+                FROM brandat_sale_line sl
+                JOIN brandat_sale s ON s.id = sl.sale_id
+                WHERE s.state = 'confirmed' {sale_filter}
+                UNION ALL
+                SELECT r.date::date, r.store_id, rl.product_id, rl.size_id, rl.color_id,
+                       0, 0.0,
+                       rl.quantity_return, rl.return_amount
+                FROM brandat_sale_return_line rl
+                JOIN brandat_sale_return r ON r.id = rl.return_id
+                WHERE r.state = 'done' AND rl.quantity_return > 0 {return_filter}
+            ) f
+            GROUP BY f.date, f.store_id, f.product_id, f.size_id, f.color_id
+            ON CONFLICT (date, store_id, product_id, size_id, color_id) DO UPDATE SET
+                quantity = EXCLUDED.quantity,
+                price_total = EXCLUDED.price_total,
+                price_unit = EXCLUDED.price_unit,
+                return_quantity = EXCLUDED.return_quantity,
+                return_amount = EXCLUDED.return_amount,
+                net_total = EXCLUDED.net_total
+        """, params)
+        self.invalidate_model()
 
 
 class BrandatStockReport(models.Model):
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
 from odoo.exceptions import ValidationError
 
+from .loyalty import LOYALTY_POINT_VALUE
+
 class BrandatSale(models.Model):
     _name = 'brandat.sale'
     _description = 'Brandat Sale'
@@ -44,10 +46,6 @@ class BrandatSale(models.Model):
     loyalty_points_earned = fields.Float(string='نقاط الولاء المكتسبة', compute='_compute_loyalty_points')
     loyalty_points_used = fields.Float(string='نقاط الولاء المستخدمة', default=0.0)
     
-    # المرتجعات
-    has_returns = fields.Boolean(string='لديه مرتجعات', compute='_compute_returns')
-    return_count = fields.Integer(string='عدد المرتجعات', compute='_compute_returns')
-    
     notes = fields.Text(string='ملاحظات')
     
     @api.depends('line_ids.price_subtotal', 'discount_type', 'discount_value', 'customer_id.discount_percentage')
@@ -74,13 +72,11 @@ class BrandatSale(models.Model):
     @api.depends('amount_total')
     def _compute_loyalty_points(self):
         for sale in self:
-            sale.loyalty_points_earned = sale.amount_total / 100
+            sale.loyalty_points_earned = sale.amount_total / LOYALTY_POINT_VALUE
     
-    def _compute_returns(self):
-        for sale in self:
-            returns = self.env['brandat.sale.return'].search([('sale_id', '=', sale.id)])
-            sale.return_count = len(returns)
-            sale.has_returns = bool(returns)
+    def init(self):
+        # فهرس مركب لاستعلامات المبيعات حسب الحالة والفترة (لوحة التحكم والتقارير)
+        tools.create_index(self.env.cr, 'brandat_sale_state_date_index', self._table, ['state', 'date'])
     
     @api.onchange('customer_id')
     def _onchange_customer_id(self):
@@ -99,32 +95,63 @@ class BrandatSale(models.Model):
             if not sale.line_ids:
                 raise ValidationError('لا يمكن تأكيد فاتورة بدون منتجات!')
             
-            for line in sale.line_ids:
-                stock = self.env['brandat.stock'].search([
-                    ('store_id', '=', sale.store_id.id),
-                    ('product_id', '=', line.product_id.id),
-                    ('size_id', '=', line.size_id.id),
-                    ('color_id', '=', line.color_id.id),
-                ], limit=1)
-                
-                if not stock or stock.quantity < line.quantity:
-                    raise ValidationError(
-                        f'الكمية غير متاحة للمنتج: {line.product_id.name}\n'
-                        f'المتاح: {stock.quantity if stock else 0}\n'
-                        f'المطلوب: {line.quantity}'
-                    )
-                
-                stock.quantity -= line.quantity
-            
-            # تحديث نقاط العميل
-            if sale.customer_id:
-                sale.customer_id.loyalty_points += sale.loyalty_points_earned
-                sale.customer_id.loyalty_points -= sale.loyalty_points_used
+            # خصم كل الأسطر دفعة واحدة مع قفل سجلات المخزون
+            self.env['brandat.stock']._apply_stock_moves([
+                (sale.store_id.id, line.product_id.id, line.size_id.id, line.color_id.id, -line.quantity)
+                for line in sale.line_ids
+            ], move_type='sale', origin=sale)
             
             sale.state = 'confirmed'
+        
+        # تحديث مشتريات ونقاط العملاء بحركة في سجل الولاء لكل فاتورة
+        self.env['brandat.loyalty.ledger']._post_entries([{
+            'customer_id': sale.customer_id.id,
+            'sale_id': sale.id,
+            'date': sale.date,
+            'move_type': 'sale',
+            'amount': sale.amount_total,
+            'points': sale.loyalty_points_earned - sale.loyalty_points_used,
+        } for sale in self if sale.customer_id])
+        
+        self.env['brandat.employee']._add_sales_totals(
+            (sale.employee_id.id, sale.amount_total, 1) for sale in self)
+        self.env['brandat.employee.commission']._refresh_employee_periods(
+            (sale.employee_id.id, sale.date) for sale in self)
+        self.env['brandat.treasury']._add_store_day_totals(
+            'total_sales', [(sale.store_id.id, sale.date, sale.amount_total) for sale in self])
+        self._update_sales_aggregates()
     
     def action_cancel(self):
+        confirmed = self.filtered(lambda s: s.state == 'confirmed')
         self.state = 'cancel'
+        confirmed._reverse_loyalty_entries()
+        self.env['brandat.employee']._add_sales_totals(
+            (sale.employee_id.id, -sale.amount_total, -1) for sale in confirmed)
+        self.env['brandat.employee.commission']._refresh_employee_periods(
+            (sale.employee_id.id, sale.date) for sale in confirmed)
+        self.env['brandat.treasury']._add_store_day_totals(
+            'total_sales', [(sale.store_id.id, sale.date, -sale.amount_total) for sale in confirmed])
+        confirmed._update_sales_aggregates(sign=-1)
+    
+    def _reverse_loyalty_entries(self):
+        """عكس كل حركات الولاء المسجلة على الفواتير (البيع والمرتجعات)"""
+        Ledger = self.env['brandat.loyalty.ledger']
+        posted = Ledger._read_group(
+            [('sale_id', 'in', self.ids)],
+            ['sale_id', 'customer_id'], ['amount:sum', 'points:sum'],
+        )
+        Ledger._post_entries([{
+            'customer_id': customer.id,
+            'sale_id': sale.id,
+            'move_type': 'cancel',
+            'amount': -amount,
+            'points': -points,
+        } for sale, customer, amount, points in posted])
+    
+    def _update_sales_aggregates(self, sign=1):
+        """تحديث المجاميع المشتقة من الفواتير بعد تأكيدها (sign=1) أو إلغائها (sign=-1)"""
+        self.env['brandat.sales.report']._apply_fact_deltas(sale_ids=self.ids, sign=sign)
+        self.env['brandat.dashboard']._invalidate_kpi_cache()
     
     def action_draft(self):
         self.state = 'draft'
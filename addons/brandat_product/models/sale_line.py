@@ -2,7 +2,9 @@ from odoo import models, fields, api
 
 class BrandatSaleLine(models.Model):
     _name = 'brandat.sale.line'
+    _inherit = ['brandat.stock.availability.mixin']
     _description = 'Brandat Sale Line'
+    _stock_availability_store_field = 'sale_id.store_id'
     
     sale_id = fields.Many2one('brandat.sale', string='الفاتورة', ondelete='cascade', required=True)
     product_id = fields.Many2one('brandat.product', string='المنتج', required=True)
@@ -12,11 +14,29 @@ class BrandatSaleLine(models.Model):
     price_unit = fields.Float(string='سعر الوحدة', required=True)
     price_subtotal = fields.Float(string='الإجمالي', compute='_compute_subtotal', store=True)
     
+    # المرتجعات المعتمدة والمكتملة على السطر
+    return_line_ids = fields.One2many('brandat.sale.return.line', 'sale_line_id', string='أسطر المرتجعات')
+    quantity_returned = fields.Integer(string='الكمية المرتجعة', compute='_compute_quantity_returned', store=True)
+    quantity_returnable = fields.Integer(string='الكمية القابلة للإرجاع', compute='_compute_quantity_returned',
+                                         store=True, index=True)
+    
     @api.depends('quantity', 'price_unit')
     def _compute_subtotal(self):
         for line in self:
             line.price_subtotal = line.quantity * line.price_unit
     
+    @api.depends('quantity', 'return_line_ids.quantity_return', 'return_line_ids.return_id.state')
+    def _compute_quantity_returned(self):
+        # يعاد الحساب للأسطر المتأثرة فقط عند اعتماد أو إكمال أو إلغاء مرتجع، باستعلام واحد لها كلها
+        returned = dict(self.env['brandat.sale.return.line']._read_group(
+            [('sale_line_id', 'in', self._origin.ids), ('return_id.state', 'in', ('approved', 'done'))],
+            ['sale_line_id'], ['quantity_return:sum'],
+        ))
+        for line in self:
+            line.quantity_returned = returned.get(line._origin, 0)
+            line.quantity_returnable = line.quantity - line.quantity_returned
+    
+    
     @api.onchange('product_id')
     def _onchange_product_id(self):
         if self.product_id:
@@ -1,6 +1,20 @@
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
 from odoo.exceptions import ValidationError
 import base64
+import hashlib
+import io
+import logging
+import tempfile
+import urllib.parse
+import zipfile
+
+from odoo.tools.pdf import PdfFileReader, PdfFileWriter
+
+_logger = logging.getLogger(__name__)
+
+INVOICE_REPORT = 'brandat_product.action_report_brandat_sale'
+INVOICE_RENDER_BATCH = 20
+INVOICE_PRINT_CHUNK = 50
 
 class BrandatSale(models.Model):
     _inherit = 'brandat.sale'
@@ -8,10 +22,144 @@ class BrandatSale(models.Model):
     # حذف الحقول اللي بتعتمد على company_id
     # وخلّيها تجيب البيانات من الإعدادات مباشرة
     
+    # نسخة PDF محفوظة من الفاتورة، صالحة طالما بصمة المحتوى لم تتغير
+    invoice_pdf_id = fields.Many2one('ir.attachment', string='ملف الفاتورة', copy=False, readonly=True)
+    invoice_pdf_fingerprint = fields.Char(string='بصمة ملف الفاتورة', copy=False, readonly=True)
+    
+    def _get_invoice_fingerprint(self):
+        """بصمة محتوى الفاتورة: القيم المعروضة في التقرير نفسها وليس تاريخ تعديل الفاتورة
+
+        حفظ البصمة أو الملف على الفاتورة يغير write_date الخاص بها، لذلك لا يدخل في البصمة
+        """
+        self.ensure_one()
+        settings = self.env['brandat.company.settings'].get_settings()
+        parts = [
+            self.name,
+            self.date,
+            self.state,
+            self.store_id.name,
+            self.notes,
+            self.amount_untaxed,
+            self.discount_amount,
+            self.amount_total,
+            [
+                (line.product_id.name, line.size_id.name, line.color_id.name,
+                 line.quantity, line.price_unit, line.price_subtotal)
+                for line in self.line_ids
+            ],
+            (self.customer_id.name, self.customer_id.phone, self.customer_id.mobile, self.customer_id.email,
+             self.customer_id.address, self.customer_id.loyalty_points),
+            (self.partner_id.name, self.partner_id.phone, self.partner_id.email),
+            # الإعدادات لا تعدل إلا من شاشتها، وتشمل الشعار والختم
+            (settings.id, settings.write_date),
+        ]
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+    
+    def _get_cached_invoice_pdf(self):
+        """ملف PDF المحفوظ إذا كان مطابقاً للفاتورة الحالية"""
+        self.ensure_one()
+        if self.invoice_pdf_id and self.invoice_pdf_fingerprint == self._get_invoice_fingerprint():
+            return self.invoice_pdf_id
+        return self.env['ir.attachment']
+    
+    def _render_invoice_pdf(self):
+        """إنشاء أو تحديث ملف PDF المحفوظ للفواتير التي تغيرت بصمتها فقط
+
+        كل الفواتير المتغيرة تنشأ باستدعاء واحد للتقرير ثم يقسم الملف لكل فاتورة
+        """
+        stale = self.filtered(lambda sale: not sale._get_cached_invoice_pdf())
+        if not stale:
+            return
+        
+        Report = self.env['ir.actions.report']
+        streams = {}
+        if len(stale) > 1:
+            streams = Report._render_qweb_pdf_prepare_streams(INVOICE_REPORT, {}, res_ids=stale.ids)
+        for sale in stale:
+            stream = streams.get(sale.id, {}).get('stream')
+            if stream:
+                pdf_content = stream.getvalue()
+            else:
+                # فاتورة واحدة، أو تعذر تقسيم الملف المجمع حسب الفواتير
+                pdf_content, _report_type = Report._render_qweb_pdf(INVOICE_REPORT, res_ids=sale.ids)
+            values = {
+                'name': f'فاتورة_{sale.name}.pdf',
+                'type': 'binary',
+                'datas': base64.b64encode(pdf_content),
+                'res_model': 'brandat.sale',
+                'res_id': sale.id,
+                'mimetype': 'application/pdf',
+            }
+            # تحديث نفس المرفق بدل إنشاء مرفق جديد في كل مرة
+            if sale.invoice_pdf_id:
+                sale.invoice_pdf_id.write(values)
+            else:
+                sale.invoice_pdf_id = self.env['ir.attachment'].create(values)
+            sale.invoice_pdf_fingerprint = sale._get_invoice_fingerprint()
+        for stream_data in streams.values():
+            if stream_data.get('stream'):
+                stream_data['stream'].close()
+    
+    def _render_invoice_pdf_batch(self):
+        """إنشاء ملفات الدفعة كلها معاً - يرجع False إذا فشلت حتى تنشأ كل فاتورة على حدة"""
+        try:
+            with self.env.cr.savepoint():
+                self._render_invoice_pdf()
+        except Exception:
+            _logger.exception('Failed to render invoice batch, falling back to one invoice at a time')
+            return False
+        return True
+    
+    def _enqueue_invoice_render(self, action='cache'):
+        """إضافة الفواتير لطابور إنشاء ملفات PDF في الخلفية"""
+        return self.env['brandat.invoice.render']._enqueue(self, action)
+    
+    def action_confirm(self):
+        res = super().action_confirm()
+        self._enqueue_invoice_render()
+        return res
+    
+    def _get_customer_email(self):
+        self.ensure_one()
+        if self.customer_id and self.customer_id.email:
+            return self.customer_id.email
+        if self.partner_id and self.partner_id.email:
+            return self.partner_id.email
+        return None
+    
+    def _send_invoice_email(self):
+        """إرسال الفاتورة بالإيميل مع ملف PDF المحفوظ"""
+        template = self.env.ref('brandat_product.email_template_brandat_sale')
+        for sale in self:
+            template.send_mail(sale.id, email_values={
+                'attachment_ids': [(4, sale.invoice_pdf_id.id)],
+            })
+            sale.message_post(
+                body=f'تم إرسال الفاتورة بالبريد الإلكتروني إلى {sale._get_customer_email()}',
+                subject='إرسال الفاتورة'
+            )
+    
     def action_print_invoice(self):
-        """طباعة الفاتورة"""
+        """طباعة الفاتورة من الملف المحفوظ أو طلب إنشائه في الخلفية"""
         self.ensure_one()
-        return self.env.ref('brandat_product.action_report_brandat_sale').report_action(self)
+        attachment = self._get_cached_invoice_pdf()
+        if attachment:
+            return {
+                'type': 'ir.actions.act_url',
+                'url': f'/web/content/{attachment.id}?download=true',
+                'target': 'new',
+            }
+        
+        self._enqueue_invoice_render()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'جاري تجهيز الفاتورة',
+                'message': f'يتم الآن تجهيز ملف الفاتورة {self.name}، يرجى إعادة الطباعة بعد لحظات',
+                'type': 'info',
+            }
+        }
     
     def action_send_email(self):
         """إرسال الفاتورة بالإيميل"""
@@ -20,51 +168,31 @@ class BrandatSale(models.Model):
         if not self.customer_id and not self.partner_id:
             raise ValidationError('يجب تحديد عميل أولاً!')
         
-        email = None
-        if self.customer_id and self.customer_id.email:
-            email = self.customer_id.email
-        elif self.partner_id and self.partner_id.email:
-            email = self.partner_id.email
-        
+        email = self._get_customer_email()
         if not email:
             raise ValidationError('لا يوجد بريد إلكتروني للعميل!')
         
-        # إنشاء PDF
-        pdf_content = self.env.ref('brandat_product.action_report_brandat_sale')._render_qweb_pdf(self.ids)
-        pdf_base64 = base64.b64encode(pdf_content[0])
-        
-        # إنشاء مرفق
-        attachment = self.env['ir.attachment'].create({
-            'name': f'فاتورة_{self.name}.pdf',
-            'type': 'binary',
-            'datas': pdf_base64,
-            'res_model': 'brandat.sale',
-            'res_id': self.id,
-            'mimetype': 'application/pdf'
-        })
-        
-        # إرسال الإيميل
-        template = self.env.ref('brandat_product.email_template_brandat_sale')
-        template.attachment_ids = [(6, 0, [attachment.id])]
-        template.send_mail(self.id, force_send=True)
-        
-        self.message_post(
-            body=f'تم إرسال الفاتورة بالبريد الإلكتروني إلى {email}',
-            subject='إرسال الفاتورة'
-        )
+        # الرسالة تضاف لطابور البريد فوراً إذا كان الملف جاهزاً، وإلا بعد إنشائه في الخلفية
+        # وفي الحالتين يتم الإرسال الفعلي من مهمة البريد، فلا نقول للمستخدم إنها أرسلت
+        if self._get_cached_invoice_pdf():
+            self._send_invoice_email()
+            message = f'تمت إضافة الفاتورة لطابور البريد وسيتم إرسالها إلى {email} خلال لحظات'
+        else:
+            self._enqueue_invoice_render('email')
+            message = f'سيتم إرسال الفاتورة إلى {email} بعد تجهيز ملفها'
         
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
-                'title': 'تم الإرسال',
-                'message': f'تم إرسال الفاتورة إلى {email}',
-                'type': 'success',
+                'title': 'في طابور الإرسال',
+                'message': message,
+                'type': 'info',
             }
         }
     
-    def action_send_whatsapp(self):
-        """إرسال الفاتورة عبر واتساب"""
+    def _get_whatsapp_link(self, settings=None):
+        """رقم الموبايل ورابط واتساب برسالة الفاتورة"""
         self.ensure_one()
         
         if not self.customer_id and not self.partner_id:
@@ -84,7 +212,7 @@ class BrandatSale(models.Model):
             raise ValidationError('لا يوجد رقم موبايل للعميل!')
         
         # الحصول على إعدادات الشركة
-        settings = self.env['brandat.company.settings'].get_settings()
+        settings = settings or self.env['brandat.company.settings'].get_settings()
         
         # تنسيق الرسالة
         message = f"""
@@ -123,9 +251,14 @@ class BrandatSale(models.Model):
         phone = mobile.replace('+', '').replace(' ', '').replace('-', '')
         
         # URL encoding للرسالة
-        import urllib.parse
         encoded_message = urllib.parse.quote(message)
-        whatsapp_url = f"https://wa.me/{phone}?text={encoded_message}"
+        return mobile, f"https://wa.me/{phone}?text={encoded_message}"
+    
+    def action_send_whatsapp(self):
+        """إرسال الفاتورة عبر واتساب"""
+        self.ensure_one()
+        
+        mobile, whatsapp_url = self._get_whatsapp_link()
         
         self.message_post(
             body=f'تم إرسال الفاتورة عبر واتساب إلى {mobile}',
@@ -137,6 +270,171 @@ class BrandatSale(models.Model):
             'url': whatsapp_url,
             'target': 'new',
         }
+    
+    def _get_dispatch_note_values(self, body):
+        """قيم ملاحظة في سجل الفاتورة لإنشائها مع باقي الملاحظات دفعة واحدة"""
+        self.ensure_one()
+        return {
+            'model': self._name,
+            'res_id': self.id,
+            'message_type': 'comment',
+            'subtype_id': self.env['ir.model.data']._xmlid_to_res_id('mail.mt_note'),
+            'body': body,
+        }
+    
+    def action_bulk_send_email(self):
+        """إرسال الفواتير المحددة بالإيميل في الخلفية"""
+        return self.env['brandat.invoice.dispatch']._create_dispatch(self, 'email')._get_action()
+    
+    def action_bulk_send_whatsapp(self):
+        """تجهيز روابط واتساب للفواتير المحددة"""
+        return self.env['brandat.invoice.dispatch']._create_dispatch(self, 'whatsapp')._get_action()
+
+
+class BrandatInvoiceRender(models.Model):
+    _name = 'brandat.invoice.render'
+    _description = 'Invoice PDF Render Queue'
+    _order = 'id'
+    
+    sale_id = fields.Many2one('brandat.sale', string='الفاتورة', required=True, ondelete='cascade')
+    action = fields.Selection([
+        ('cache', 'تجهيز الملف'),
+        ('email', 'إرسال بالإيميل'),
+    ], string='العملية', required=True, default='cache')
+    state = fields.Selection([
+        ('pending', 'في الانتظار'),
+        ('done', 'تم'),
+        ('failed', 'فشل'),
+    ], string='الحالة', default='pending', required=True, index=True)
+    error = fields.Text(string='الخطأ', readonly=True)
+    
+    @api.model
+    def _enqueue(self, sales, action='cache'):
+        """إضافة طلبات جديدة فقط (بدون تكرار الطلبات المعلقة) وتشغيل المهمة فوراً"""
+        pending = self.search([
+            ('sale_id', 'in', sales.ids),
+            ('action', '=', action),
+            ('state', '=', 'pending'),
+        ])
+        queued = set(pending.sale_id.ids)
+        requests = self.create([
+            {'sale_id': sale.id, 'action': action}
+            for sale in sales if sale.id not in queued
+        ])
+        if requests:
+            self.env.ref('brandat_product.ir_cron_render_invoices')._trigger()
+        return pending | requests
+    
+    @api.model
+    def _process_queue(self, limit=INVOICE_RENDER_BATCH):
+        """مهمة الخلفية: إنشاء ملفات PDF للطلبات المعلقة ثم تنفيذ الإرسال المطلوب"""
+        requests = self.search([('state', '=', 'pending')], limit=limit)
+        rendered = requests.sale_id._render_invoice_pdf_batch()
+        for request in requests:
+            try:
+                with self.env.cr.savepoint():
+                    if not rendered:
+                        request.sale_id._render_invoice_pdf()
+                    if request.action == 'email':
+                        request.sale_id._send_invoice_email()
+                    request.state = 'done'
+            except Exception as e:
+                _logger.exception('Failed to render invoice %s', request.sale_id.name)
+                request.write({'state': 'failed', 'error': str(e)})
+        
+        # استكمال باقي الطابور في تشغيل جديد
+        if len(requests) == limit:
+            self.env.ref('brandat_product.ir_cron_render_invoices')._trigger()
+        
+        # حذف الطلبات المنتهية
+        self.search([('state', '=', 'done')]).unlink()
+
+
+class ReportBrandatSaleDocument(models.AbstractModel):
+    _name = 'report.brandat_product.report_brandat_sale_document'
+    _description = 'Brandat Sale Invoice Report'
+    
+    @api.model
+    def _get_report_values(self, docids, data=None):
+        docs = self.env['brandat.sale'].browse(docids)
+        # تحميل كل السجلات المرتبطة بعدد ثابت من الاستعلامات بدل التحميل عند الحاجة لكل فاتورة
+        lines = docs.line_ids
+        lines.product_id.mapped('name')
+        lines.size_id.mapped('name')
+        lines.color_id.mapped('name')
+        docs.customer_id.mapped('name')
+        docs.partner_id.mapped('name')
+        docs.store_id.mapped('name')
+        return {
+            'doc_ids': docids,
+            'doc_model': 'brandat.sale',
+            'docs': docs,
+            'data': data,
+        }
+
+
+class BrandatSalePrintBatch(models.TransientModel):
+    _name = 'brandat.sale.print.batch'
+    _description = 'Batch Invoice Printing'
+    
+    sale_ids = fields.Many2many('brandat.sale', string='الفواتير', required=True)
+    file_format = fields.Selection([
+        ('pdf', 'ملف PDF واحد'),
+        ('zip', 'ملف ZIP (ملف لكل دفعة)'),
+    ], string='نوع الملف', default='pdf', required=True)
+    sale_count = fields.Integer(string='عدد الفواتير', compute='_compute_sale_count')
+    
+    @api.model
+    def default_get(self, fields_list):
+        res = super().default_get(fields_list)
+        if self.env.context.get('active_model') == 'brandat.sale' and self.env.context.get('active_ids'):
+            res['sale_ids'] = [(6, 0, self.env.context['active_ids'])]
+        return res
+    
+    @api.depends('sale_ids')
+    def _compute_sale_count(self):
+        for wizard in self:
+            wizard.sale_count = len(wizard.sale_ids)
+    
+    def _iter_invoice_chunks(self):
+        """إنشاء ملفات PDF على دفعات - يرجع (الفواتير، محتوى PDF) لكل دفعة"""
+        sale_ids = self.sale_ids.sorted('name').ids
+        for start in range(0, len(sale_ids), INVOICE_PRINT_CHUNK):
+            chunk = self.env['brandat.sale'].browse(sale_ids[start:start + INVOICE_PRINT_CHUNK])
+            pdf_content, _report_type = self.env['ir.actions.report']._render_qweb_pdf(INVOICE_REPORT, res_ids=chunk.ids)
+            yield chunk, pdf_content
+            # تفريغ الكاش بعد كل دفعة حتى لا تتراكم سجلات كل الفواتير في الذاكرة
+            self.env.invalidate_all()
+    
+    def _export_invoices(self):
+        """كتابة الفواتير في ملف مؤقت - يرجع (الملف، الاسم، نوع المحتوى)"""
+        self.ensure_one()
+        output = tempfile.TemporaryFile()
+        
+        if self.file_format == 'zip':
+            with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for chunk, pdf_content in self._iter_invoice_chunks():
+                    archive.writestr(f'فواتير_{chunk[0].name}_{chunk[-1].name}.pdf'.replace('/', '-'), pdf_content)
+            filename, mimetype = 'فواتير.zip', 'application/zip'
+        else:
+            writer = PdfFileWriter()
+            for _chunk, pdf_content in self._iter_invoice_chunks():
+                reader = PdfFileReader(io.BytesIO(pdf_content), strict=False)
+                for page in range(reader.getNumPages()):
+                    writer.addPage(reader.getPage(page))
+            writer.write(output)
+            filename, mimetype = 'فواتير.pdf', 'application/pdf'
+        
+        output.seek(0)
+        return output, filename, mimetype
+    
+    def action_print(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/brandat/sale/print_batch/{self.id}',
+            'target': 'self',
+        }
 
 
 class BrandatCompanySettings(models.Model):
@@ -174,14 +472,32 @@ class BrandatCompanySettings(models.Model):
     
     @api.model
     def get_settings(self):
-        """الحصول على إعدادات الشركة"""
-        settings = self.search([], limit=1)
-        if not settings:
-            settings = self.create({
+        """الحصول على إعدادات الشركة (معرف السجل محفوظ في كاش الـ registry)"""
+        return self.browse(self._get_settings_id())
+    
+    @tools.ormcache()
+    def _get_settings_id(self):
+        return self.sudo().search([], limit=1).id
+    
+    @api.model
+    def _ensure_settings(self):
+        """إنشاء سجل الإعدادات عند التثبيت أو الترقية إذا لم يكن موجوداً"""
+        if not self.sudo().search_count([], limit=1):
+            self.sudo().create({
                 'name': 'إعدادات الشركة',
                 'company_name': 'براندات للملابس',
                 'phone1': '+20 123 456 7890',
                 'email': 'info@brandat.com',
                 'address_ar': 'القاهرة، مصر',
             })
-        return settings
\ No newline at end of file
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return records
+    
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
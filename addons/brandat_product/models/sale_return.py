@@ -2,6 +2,8 @@ from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
 from datetime import datetime, timedelta
 
+from .loyalty import LOYALTY_POINT_VALUE
+
 class BrandatSaleReturn(models.Model):
     _name = 'brandat.sale.return'
     _description = 'Sale Return'
@@ -89,9 +91,9 @@ class BrandatSaleReturn(models.Model):
             # حذف الأسطر القديمة
             self.line_ids = [(5, 0, 0)]
             
-            # إنشاء أسطر جديدة من الفاتورة
+            # إنشاء أسطر جديدة من الفاتورة (الأسطر التي لم ترجع بالكامل فقط)
             lines = []
-            for sale_line in self.sale_id.line_ids:
+            for sale_line in self.sale_id.line_ids.filtered(lambda l: l.quantity_returnable > 0):
                 lines.append((0, 0, {
                     'sale_line_id': sale_line.id,
                     'product_id': sale_line.product_id.id,
@@ -113,12 +115,20 @@ class BrandatSaleReturn(models.Model):
         if not self.can_return:
             raise ValidationError(f'تجاوزت مدة الإرجاع المسموحة ({self.return_period_days} أيام)!')
         
-        # التحقق من الكميات
+        # قفل أسطر الفاتورة حتى لا يعتمد مرتجعان متزامنان نفس الكمية، ثم إعادة قراءة المتبقي
+        sale_lines = self.line_ids.sale_line_id
+        if sale_lines:
+            self.env.cr.execute("""
+                SELECT id FROM brandat_sale_line WHERE id IN %s ORDER BY id FOR UPDATE
+            """, [tuple(sale_lines.ids)])
+            sale_lines.invalidate_recordset(['quantity_returned', 'quantity_returnable'])
+        
+        # التحقق من الكميات مقابل المتبقي القابل للإرجاع بعد المرتجعات السابقة
         for line in self.line_ids:
-            if line.quantity_return > line.quantity_sold:
+            if line.quantity_return > line.sale_line_id.quantity_returnable:
                 raise ValidationError(
-                    f'الكمية المرتجعة ({line.quantity_return}) أكبر من الكمية المباعة ({line.quantity_sold}) '
-                    f'للمنتج: {line.product_id.name}'
+                    f'الكمية المرتجعة ({line.quantity_return}) أكبر من الكمية القابلة للإرجاع '
+                    f'({line.sale_line_id.quantity_returnable}) للمنتج: {line.product_id.name}'
                 )
         
         self.state = 'approved'
@@ -136,45 +146,34 @@ class BrandatSaleReturn(models.Model):
             raise ValidationError('يجب اعتماد المرتجع أولاً!')
         
         # إرجاع المنتجات المرتجعة للمخزون
-        for line in self.line_ids.filtered(lambda l: l.quantity_return > 0):
-            stock = self.env['brandat.stock'].search([
-                ('store_id', '=', self.store_id.id),
-                ('product_id', '=', line.product_id.id),
-                ('size_id', '=', line.size_id.id),
-                ('color_id', '=', line.color_id.id),
-            ], limit=1)
-            
-            if stock:
-                stock.quantity += line.quantity_return
-            else:
-                self.env['brandat.stock'].create({
-                    'store_id': self.store_id.id,
-                    'product_id': line.product_id.id,
-                    'size_id': line.size_id.id,
-                    'color_id': line.color_id.id,
-                    'quantity': line.quantity_return,
-                })
+        moves = [
+            (self.store_id.id, line.product_id.id, line.size_id.id, line.color_id.id, line.quantity_return)
+            for line in self.line_ids.filtered(lambda l: l.quantity_return > 0)
+        ]
         
         # في حالة الاستبدال، خصم المنتجات البديلة من المخزون
         if self.return_type == 'exchange':
-            for line in self.exchange_line_ids:
-                stock = self.env['brandat.stock'].search([
-                    ('store_id', '=', self.store_id.id),
-                    ('product_id', '=', line.product_id.id),
-                    ('size_id', '=', line.size_id.id),
-                    ('color_id', '=', line.color_id.id),
-                ], limit=1)
-                
-                if not stock or stock.quantity < line.quantity:
-                    raise ValidationError(
-                        f'الكمية غير متاحة في المخزون للمنتج البديل: {line.product_id.name}\n'
-                        f'المتاح: {stock.quantity if stock else 0}\n'
-                        f'المطلوب: {line.quantity}'
-                    )
-                
-                stock.quantity -= line.quantity
+            moves += [
+                (self.store_id.id, line.product_id.id, line.size_id.id, line.color_id.id, -line.quantity)
+                for line in self.exchange_line_ids
+            ]
+        
+        self.env['brandat.stock']._apply_stock_moves(moves, move_type='return', origin=self)
         
         self.state = 'done'
+        self.env['brandat.sales.report']._apply_fact_deltas(return_ids=self.ids)
+        
+        # خصم المرتجع (أو إضافة فرق الاستبدال) من مشتريات ونقاط العميل
+        if self.customer_id:
+            self.env['brandat.loyalty.ledger']._post_entries([{
+                'customer_id': self.customer_id.id,
+                'sale_id': self.sale_id.id,
+                'return_id': self.id,
+                'date': self.date,
+                'move_type': 'return',
+                'amount': self.difference_amount,
+                'points': self.difference_amount / LOYALTY_POINT_VALUE,
+            }])
         
         message = f'تم إكمال {dict(self._fields["return_type"].selection)[self.return_type]} رقم {self.name}\n'
         if self.return_type == 'return':
@@ -206,6 +205,7 @@ class BrandatSaleReturnLine(models.Model):
     _description = 'Sale Return Line'
     
     return_id = fields.Many2one('brandat.sale.return', string='المرتجع', ondelete='cascade', required=True)
+    sale_id = fields.Many2one(related='return_id.sale_id', string='الفاتورة', store=True, index=True)
     sale_line_id = fields.Many2one('brandat.sale.line', string='سطر الفاتورة', required=True)
     
     product_id = fields.Many2one('brandat.product', string='المنتج', required=True)
@@ -213,6 +213,7 @@ class BrandatSaleReturnLine(models.Model):
     color_id = fields.Many2one('brandat.color', string='اللون', required=True)
     
     quantity_sold = fields.Integer(string='الكمية المباعة', readonly=True)
+    quantity_returnable = fields.Integer(related='sale_line_id.quantity_returnable', string='القابل للإرجاع')
     quantity_return = fields.Integer(string='الكمية المرتجعة', default=0)
     
     price_unit = fields.Float(string='سعر الوحدة', readonly=True)
@@ -236,7 +237,9 @@ class BrandatSaleReturnLine(models.Model):
 
 class BrandatSaleReturnExchange(models.Model):
     _name = 'brandat.sale.return.exchange'
+    _inherit = ['brandat.stock.availability.mixin']
     _description = 'Sale Return Exchange Line'
+    _stock_availability_store_field = 'return_id.store_id'
     
     return_id = fields.Many2one('brandat.sale.return', string='المرتجع', ondelete='cascade', required=True)
     
@@ -253,6 +256,7 @@ class BrandatSaleReturnExchange(models.Model):
         for line in self:
             line.exchange_amount = line.quantity * line.price_unit
     
+    
     @api.onchange('product_id')
     def _onchange_product_id(self):
         if self.product_id:
@@ -265,13 +269,36 @@ class BrandatSale(models.Model):
     
     return_ids = fields.One2many('brandat.sale.return', 'sale_id', string='المرتجعات')
     return_count = fields.Integer(string='عدد المرتجعات', compute='_compute_return_count')
-    has_returns = fields.Boolean(string='يوجد مرتجعات', compute='_compute_return_count')
+    has_returns = fields.Boolean(string='يوجد مرتجعات', compute='_compute_return_totals', store=True, index=True)
+    returned_quantity = fields.Integer(string='الكمية المرتجعة', compute='_compute_return_totals', store=True)
+    returned_amount = fields.Float(string='مبلغ المرتجعات', compute='_compute_return_totals', store=True)
     
     @api.depends('return_ids')
     def _compute_return_count(self):
+        # عد المرتجعات لكل الفواتير باستعلام واحد بدل بحث لكل فاتورة
+        counts = dict(self.env['brandat.sale.return']._read_group(
+            [('sale_id', 'in', self._origin.ids)], ['sale_id'], ['__count'],
+        ))
+        for sale in self:
+            sale.return_count = counts.get(sale._origin, 0)
+    
+    @api.depends('return_ids.state', 'return_ids.line_ids.quantity_return', 'return_ids.line_ids.return_amount')
+    def _compute_return_totals(self):
+        sale_ids = self._origin.ids
+        open_returns = dict(self.env['brandat.sale.return']._read_group(
+            [('sale_id', 'in', sale_ids), ('state', '!=', 'cancel')], ['sale_id'], ['__count'],
+        ))
+        # الكميات والمبالغ من المرتجعات المكتملة فقط
+        totals = {
+            sale: (quantity, amount)
+            for sale, quantity, amount in self.env['brandat.sale.return.line']._read_group(
+                [('sale_id', 'in', sale_ids), ('return_id.state', '=', 'done')],
+                ['sale_id'], ['quantity_return:sum', 'return_amount:sum'],
+            )
+        }
         for sale in self:
-            sale.return_count = len(sale.return_ids)
-            sale.has_returns = sale.return_count > 0
+            sale.has_returns = bool(open_returns.get(sale._origin))
+            sale.returned_quantity, sale.returned_amount = totals.get(sale._origin, (0, 0.0))
     
     def action_view_returns(self):
         self.ensure_one()
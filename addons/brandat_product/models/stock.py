@@ -1,4 +1,7 @@
-from odoo import models, fields
+from collections import defaultdict
+
+from odoo import models, fields, api
+from odoo.exceptions import ValidationError
 
 class BrandatStock(models.Model):
     _name = 'brandat.stock'
@@ -9,3 +12,274 @@ class BrandatStock(models.Model):
     color_id = fields.Many2one('brandat.color', string='Color', required=True)
     store_id = fields.Many2one('brandat.store', string='Store', required=True)
     quantity = fields.Integer(string='Quantity', default=0)
+
+    _sql_constraints = [
+        ('store_variant_unique', 'unique(store_id, product_id, size_id, color_id)',
+         'يوجد سجل مخزون بالفعل لهذا المنتج بنفس المقاس واللون في هذا الفرع!')
+    ]
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        stocks = super().create(vals_list)
+        # الإنشاء اليدوي بكمية يسجل كحركة تسوية حتى يبقى سجل الحركات مطابقاً للمخزون
+        self.env['brandat.stock.move']._record_moves(stocks._get_key_quantities(), 'adjust')
+        return stocks
+
+    def write(self, vals):
+        if not {'quantity', 'store_id', 'product_id', 'size_id', 'color_id'} & set(vals):
+            return super().write(vals)
+        before = self._get_key_quantities()
+        res = super().write(vals)
+        after = self._get_key_quantities()
+        # التعديل اليدوي للكمية (أو للمفتاح) يسجل بالفرق كحركة تسوية
+        deltas = {key: after.get(key, 0) - before.get(key, 0) for key in before.keys() | after.keys()}
+        self.env['brandat.stock.move']._record_moves(
+            {key: delta for key, delta in deltas.items() if delta}, 'adjust')
+        return res
+
+    def _get_key_quantities(self):
+        """{(الفرع، المنتج، المقاس، اللون): الكمية} للسجلات غير الصفرية"""
+        quantities = defaultdict(int)
+        for stock in self:
+            if stock.quantity:
+                quantities[(stock.store_id.id, stock.product_id.id, stock.size_id.id, stock.color_id.id)] += stock.quantity
+        return dict(quantities)
+
+    @api.model
+    def _get_stock_map(self, keys, create=False):
+        """جلب سجلات المخزون لمجموعة مفاتيح (الفرع، المنتج، المقاس، اللون) باستعلام واحد
+
+        يرجع قاموس {المفتاح: سجل المخزون}، ومع create=True يتم إنشاء السجلات الناقصة دفعة واحدة
+        بجملة INSERT ... ON CONFLICT DO NOTHING فلا تتكرر مع المعاملات المتزامنة
+        """
+        keys = list(dict.fromkeys(tuple(key) for key in keys))
+        if not keys:
+            return {}
+
+        stock_map = self._select_stock_rows(keys)
+        missing = [key for key in keys if key not in stock_map]
+        if create and missing:
+            self._upsert_stock(dict.fromkeys(missing, 0), increment=False)
+            # السجلات التي أنشأتها معاملة أخرى في نفس اللحظة لا ترجع من الإدخال، فتقرأ كلها مرة أخرى
+            stock_map.update(self._select_stock_rows(missing))
+
+        # تجميع السجلات في recordset واحد لتفعيل الـ prefetch عند القراءة
+        prefetch_ids = tuple(stock.id for stock in stock_map.values())
+        return {
+            key: stock.with_prefetch(prefetch_ids)
+            for key, stock in stock_map.items()
+        }
+
+    @api.model
+    def _select_stock_rows(self, keys):
+        self.flush_model(['store_id', 'product_id', 'size_id', 'color_id'])
+        self.env.cr.execute("""
+            SELECT id, store_id, product_id, size_id, color_id
+            FROM brandat_stock
+            WHERE (store_id, product_id, size_id, color_id) IN %s
+        """, [tuple(keys)])
+        return {
+            (store_id, product_id, size_id, color_id): self.browse(stock_id)
+            for stock_id, store_id, product_id, size_id, color_id in self.env.cr.fetchall()
+        }
+
+    @api.model
+    def _get_available_qty_map(self, keys):
+        """الكميات المتاحة لمجموعة مفاتيح باستعلام واحد - المفاتيح الناقصة (أو غير المكتملة) كميتها صفر"""
+        keys = [key for key in dict.fromkeys(tuple(key) for key in keys) if all(key)]
+        if not keys:
+            return {}
+
+        self.flush_model(['store_id', 'product_id', 'size_id', 'color_id', 'quantity'])
+        self.env.cr.execute("""
+            SELECT store_id, product_id, size_id, color_id, quantity
+            FROM brandat_stock
+            WHERE (store_id, product_id, size_id, color_id) IN %s
+        """, [tuple(keys)])
+        return {
+            (store_id, product_id, size_id, color_id): quantity
+            for store_id, product_id, size_id, color_id, quantity in self.env.cr.fetchall()
+        }
+
+    @api.model
+    def _lock_stock_rows(self, keys):
+        """قفل سجلات المخزون بترتيب ثابت حسب id لتجنب الـ deadlock بين الفروع
+
+        يرجع قاموس {المفتاح: (id, الكمية الحالية)}
+        """
+        keys = list(dict.fromkeys(tuple(key) for key in keys))
+        if not keys:
+            return {}
+
+        self.flush_model(['store_id', 'product_id', 'size_id', 'color_id', 'quantity'])
+        self.env.cr.execute("""
+            SELECT id, store_id, product_id, size_id, color_id, quantity
+            FROM brandat_stock
+            WHERE (store_id, product_id, size_id, color_id) IN %s
+            ORDER BY id
+            FOR UPDATE
+        """, [tuple(keys)])
+        return {
+            (store_id, product_id, size_id, color_id): (stock_id, quantity)
+            for stock_id, store_id, product_id, size_id, color_id, quantity in self.env.cr.fetchall()
+        }
+
+    @api.model
+    def _apply_stock_moves(self, moves, move_type='adjust', origin=None):
+        """محرك حركة المخزون: تطبيق كل حركات المستند بجملة UPDATE واحدة محمية
+
+        moves: قائمة (store_id, product_id, size_id, color_id, delta) والكمية السالبة تعني خصم.
+        يتم التحقق من كل الأسطر أولاً ورفع خطأ واحد بكل الكميات غير المتاحة،
+        ثم تسجل الحركات في سجل حركات المخزون (brandat.stock.move) مع المستند الأصلي origin.
+        """
+        deltas = defaultdict(int)
+        for store_id, product_id, size_id, color_id, delta in moves:
+            deltas[(store_id, product_id, size_id, color_id)] += delta
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return self.browse()
+
+        # إضافة فقط (استلام بضاعة): لا يوجد خصم للتحقق منه، فتطبق كلها بجملة upsert واحدة
+        if all(delta > 0 for delta in deltas.values()):
+            stocks = self._upsert_stock(deltas)
+            self.env['brandat.stock.move']._record_moves(deltas, move_type, origin)
+            return stocks
+
+        # السجلات الناقصة مطلوبة فقط للإضافة، أما الخصم من سجل غير موجود فهو نقص
+        incoming = [key for key, delta in deltas.items() if delta > 0]
+        if incoming:
+            self._get_stock_map(incoming, create=True)
+
+        rows = self._lock_stock_rows(deltas)
+
+        shortages = []
+        for key, delta in deltas.items():
+            available = rows[key][1] if key in rows else 0
+            if available + delta < 0:
+                shortages.append((key, available, -delta))
+        if shortages:
+            raise ValidationError(self._format_stock_shortages(shortages))
+
+        stock_ids = [rows[key][0] for key in deltas]
+        self.env.cr.execute("""
+            UPDATE brandat_stock s
+            SET quantity = s.quantity + v.delta,
+                write_uid = %s,
+                write_date = (clock_timestamp() at time zone 'UTC')
+            FROM unnest(%s::int[], %s::int[]) AS v(id, delta)
+            WHERE s.id = v.id
+              AND s.quantity + v.delta >= 0
+            RETURNING s.id
+        """, [self.env.uid, stock_ids, list(deltas.values())])
+        updated_ids = [row[0] for row in self.env.cr.fetchall()]
+        if len(updated_ids) != len(stock_ids):
+            # لا يحدث طالما السجلات مقفولة، لكن لا نسمح أبداً بمخزون سالب
+            raise ValidationError('تغير المخزون أثناء التنفيذ، يرجى المحاولة مرة أخرى!')
+
+        self.env['brandat.stock.move']._record_moves(deltas, move_type, origin)
+
+        # تحديث الكاش وإعادة حساب الحقول المعتمدة على الكمية
+        stocks = self.browse(updated_ids)
+        stocks.invalidate_recordset(['quantity', 'write_uid', 'write_date'])
+        stocks.modified(['quantity'])
+        return stocks
+
+    @api.model
+    def _upsert_stock(self, deltas, increment=True):
+        """إضافة الكميات للمخزون بجملة INSERT ... ON CONFLICT واحدة
+
+        السجلات الناقصة تنشأ بالقيم الافتراضية والموجودة تزيد كميتها، والقيد الفريد على
+        (الفرع، المنتج، المقاس، اللون) يمنع تكرار السجل مع الاستلامات المتزامنة.
+        مع increment=False يتم إنشاء السجلات الناقصة فقط بدون تعديل الموجودة.
+        """
+        # ترتيب ثابت للمفاتيح حتى تؤخذ الأقفال بنفس الترتيب في كل المعاملات ولا يحدث deadlock
+        keys = sorted(deltas)
+        defaults = {
+            name: value
+            for name, value in self.default_get(list(self._fields)).items()
+            if self._fields[name].store and self._fields[name].column_type
+            and name not in ('store_id', 'product_id', 'size_id', 'color_id', 'quantity')
+        }
+        columns = ''.join(f', {name}' for name in defaults)
+        values = ''.join(f', %({name})s' for name in defaults)
+        if increment:
+            conflict = """DO UPDATE SET quantity = brandat_stock.quantity + EXCLUDED.quantity,
+                                    write_uid = EXCLUDED.write_uid,
+                                    write_date = EXCLUDED.write_date"""
+        else:
+            conflict = "DO NOTHING"
+
+        self.flush_model()
+        self.env.cr.execute(f"""
+            INSERT INTO brandat_stock (
+                store_id, product_id, size_id, color_id, quantity{columns},
+                create_uid, create_date, write_uid, write_date
+            )
+            SELECT v.store_id, v.product_id, v.size_id, v.color_id, v.quantity{values},
+                   %(uid)s, clock_timestamp() at time zone 'UTC',
+                   %(uid)s, clock_timestamp() at time zone 'UTC'
+            FROM unnest(%(store_ids)s::int[], %(product_ids)s::int[], %(size_ids)s::int[],
+                        %(color_ids)s::int[], %(quantities)s::int[])
+                 AS v(store_id, product_id, size_id, color_id, quantity)
+            ON CONFLICT (store_id, product_id, size_id, color_id) {conflict}
+            RETURNING id
+        """, {
+            **defaults,
+            'uid': self.env.uid,
+            'store_ids': [key[0] for key in keys],
+            'product_ids': [key[1] for key in keys],
+            'size_ids': [key[2] for key in keys],
+            'color_ids': [key[3] for key in keys],
+            'quantities': [deltas[key] for key in keys],
+        })
+        stocks = self.browse(row[0] for row in self.env.cr.fetchall())
+        stocks.invalidate_recordset(['quantity', 'write_uid', 'write_date'])
+        stocks.modified(['quantity'])
+        return stocks
+
+    @api.model
+    def _format_stock_shortages(self, shortages):
+        """رسالة خطأ واحدة بكل الأسطر غير المتاحة"""
+        stores = self.env['brandat.store'].browse({key[0] for key, _available, _needed in shortages})
+        products = self.env['brandat.product'].browse({key[1] for key, _available, _needed in shortages})
+        sizes = self.env['brandat.size'].browse({key[2] for key, _available, _needed in shortages})
+        colors = self.env['brandat.color'].browse({key[3] for key, _available, _needed in shortages})
+        names = {
+            model: dict(zip(records.ids, records.mapped('name')))
+            for model, records in (('store', stores), ('product', products), ('size', sizes), ('color', colors))
+        }
+
+        message = 'الكميات التالية غير متاحة في المخزون:\n'
+        for (store_id, product_id, size_id, color_id), available, needed in shortages:
+            message += (
+                f"• {names['product'][product_id]} ({names['size'][size_id]} - {names['color'][color_id]})"
+                f" - الفرع: {names['store'][store_id]}"
+                f" | المتاح: {available} | المطلوب: {needed}\n"
+            )
+        return message
+
+
+class BrandatStockAvailabilityMixin(models.AbstractModel):
+    _name = 'brandat.stock.availability.mixin'
+    _description = 'Stock Availability Mixin'
+
+    # مسار فرع المخزون في السطر (مثل sale_id.store_id) لإعادة الحساب عند تغيير الفرع
+    _stock_availability_store_field = None
+
+    available_qty = fields.Integer(string='المتاح', compute='_compute_available_qty')
+
+    def _get_stock_availability_key(self):
+        """مفتاح المخزون للسطر: (الفرع، المنتج، المقاس، اللون)"""
+        self.ensure_one()
+        store = self.mapped(self._stock_availability_store_field)
+        return (store.id, self.product_id.id, self.size_id.id, self.color_id.id)
+
+    @api.depends(lambda self: [
+        'product_id', 'size_id', 'color_id', self._stock_availability_store_field,
+    ] if self._stock_availability_store_field else [])
+    def _compute_available_qty(self):
+        # الكميات المتاحة لكل الأسطر باستعلام واحد
+        keys = {line: line._get_stock_availability_key() for line in self}
+        available = self.env['brandat.stock']._get_available_qty_map(keys.values())
+        for line, key in keys.items():
+            line.available_qty = available.get(key, 0)
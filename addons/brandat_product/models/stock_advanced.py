@@ -1,7 +1,11 @@
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import ValidationError
 from datetime import datetime, timedelta
 
+# هامش تداخل فحص التنبيهات: الفحص التالي يبدأ من قبل بداية الفحص الحالي بهذه المدة
+# حتى يشمل المعاملات التي عدلت المخزون قبله ولم تحفظ إلا بعده
+STOCK_ALERT_CHECK_OVERLAP = timedelta(hours=1)
+
 class BrandatStockTransfer(models.Model):
     _name = 'brandat.stock.transfer'
     _description = 'Stock Transfer Between Stores'
@@ -32,11 +36,12 @@ class BrandatStockTransfer(models.Model):
             if transfer.store_from_id == transfer.store_to_id:
                 raise ValidationError('لا يمكن التحويل من نفس الفرع إلى نفسه!')
     
-    @api.model
-    def create(self, vals):
-        if vals.get('name', 'New') == 'New':
-            vals['name'] = self.env['ir.sequence'].next_by_code('brandat.stock.transfer') or 'New'
-        return super().create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if vals.get('name', 'New') == 'New':
+                vals['name'] = self.env['ir.sequence'].next_by_code('brandat.stock.transfer') or 'New'
+        return super().create(vals_list)
     
     def action_confirm(self):
         """تأكيد التحويل - خصم من المخزون الأصلي"""
@@ -44,25 +49,11 @@ class BrandatStockTransfer(models.Model):
             if not transfer.line_ids:
                 raise ValidationError('لا يمكن تأكيد تحويل بدون منتجات!')
             
-            for line in transfer.line_ids:
-                # البحث عن المخزون في الفرع الأصلي
-                stock_from = self.env['brandat.stock'].search([
-                    ('store_id', '=', transfer.store_from_id.id),
-                    ('product_id', '=', line.product_id.id),
-                    ('size_id', '=', line.size_id.id),
-                    ('color_id', '=', line.color_id.id),
-                ], limit=1)
-                
-                if not stock_from or stock_from.quantity < line.quantity:
-                    raise ValidationError(
-                        f'الكمية غير متاحة في {transfer.store_from_id.name}\n'
-                        f'المنتج: {line.product_id.name}\n'
-                        f'المتاح: {stock_from.quantity if stock_from else 0}\n'
-                        f'المطلوب: {line.quantity}'
-                    )
-                
-                # خصم من الفرع الأصلي
-                stock_from.quantity -= line.quantity
+            # خصم كل الأسطر من الفرع الأصلي دفعة واحدة
+            self.env['brandat.stock']._apply_stock_moves([
+                (transfer.store_from_id.id, line.product_id.id, line.size_id.id, line.color_id.id, -line.quantity)
+                for line in transfer.line_ids
+            ], move_type='transfer_out', origin=transfer)
             
             transfer.state = 'confirmed'
             
@@ -78,26 +69,11 @@ class BrandatStockTransfer(models.Model):
             if transfer.state != 'confirmed':
                 raise ValidationError('يجب تأكيد التحويل أولاً!')
             
-            for line in transfer.line_ids:
-                # البحث عن المخزون في الفرع المستهدف
-                stock_to = self.env['brandat.stock'].search([
-                    ('store_id', '=', transfer.store_to_id.id),
-                    ('product_id', '=', line.product_id.id),
-                    ('size_id', '=', line.size_id.id),
-                    ('color_id', '=', line.color_id.id),
-                ], limit=1)
-                
-                if stock_to:
-                    stock_to.quantity += line.quantity
-                else:
-                    # إنشاء سجل جديد
-                    self.env['brandat.stock'].create({
-                        'store_id': transfer.store_to_id.id,
-                        'product_id': line.product_id.id,
-                        'size_id': line.size_id.id,
-                        'color_id': line.color_id.id,
-                        'quantity': line.quantity,
-                    })
+            # إضافة كل الأسطر للفرع المستهدف دفعة واحدة
+            self.env['brandat.stock']._apply_stock_moves([
+                (transfer.store_to_id.id, line.product_id.id, line.size_id.id, line.color_id.id, line.quantity)
+                for line in transfer.line_ids
+            ], move_type='transfer_in', origin=transfer)
             
             transfer.state = 'done'
             
@@ -118,7 +94,9 @@ class BrandatStockTransfer(models.Model):
 
 class BrandatStockTransferLine(models.Model):
     _name = 'brandat.stock.transfer.line'
+    _inherit = ['brandat.stock.availability.mixin']
     _description = 'Stock Transfer Line'
+    _stock_availability_store_field = 'transfer_id.store_from_id'
     
     transfer_id = fields.Many2one('brandat.stock.transfer', string='التحويل', ondelete='cascade', required=True)
     product_id = fields.Many2one('brandat.product', string='المنتج', required=True)
@@ -126,21 +104,6 @@ class BrandatStockTransferLine(models.Model):
     color_id = fields.Many2one('brandat.color', string='اللون', required=True)
     quantity = fields.Integer(string='الكمية', default=1, required=True)
     
-    available_qty = fields.Integer(string='الكمية المتاحة', compute='_compute_available_qty')
-    
-    @api.depends('product_id', 'size_id', 'color_id', 'transfer_id.store_from_id')
-    def _compute_available_qty(self):
-        for line in self:
-            if line.transfer_id.store_from_id and line.product_id and line.size_id and line.color_id:
-                stock = self.env['brandat.stock'].search([
-                    ('store_id', '=', line.transfer_id.store_from_id.id),
-                    ('product_id', '=', line.product_id.id),
-                    ('size_id', '=', line.size_id.id),
-                    ('color_id', '=', line.color_id.id),
-                ], limit=1)
-                line.available_qty = stock.quantity if stock else 0
-            else:
-                line.available_qty = 0
 
 
 class BrandatStockInventory(models.Model):
@@ -166,10 +129,25 @@ class BrandatStockInventory(models.Model):
     difference_count = fields.Integer(string='عدد الفروقات', compute='_compute_differences')
     notes = fields.Text(string='ملاحظات')
     
+    # نطاق الجرد (جرد كامل أو جرد دوري)
+    scope = fields.Selection([
+        ('all', 'كل المخزون'),
+        ('products', 'منتجات محددة'),
+        ('changed', 'المتغير منذ آخر جرد'),
+    ], string='نطاق الجرد', default='all', required=True, tracking=True)
+    product_ids = fields.Many2many('brandat.product', string='المنتجات')
+    # وقت تطبيق الجرد فعلياً - بداية نطاق "المتغير منذ آخر جرد" للجرد التالي
+    validated_date = fields.Datetime(string='تاريخ التطبيق', readonly=True, copy=False)
+    
     @api.depends('line_ids.difference')
     def _compute_differences(self):
+        # عد الفروقات في قاعدة البيانات بدل تحميل كل أسطر الجرد
+        counts = dict(self.env['brandat.stock.inventory.line']._read_group(
+            [('inventory_id', 'in', self.ids), ('difference', '!=', 0)],
+            ['inventory_id'], ['__count'],
+        ))
         for inventory in self:
-            inventory.difference_count = len(inventory.line_ids.filtered(lambda l: l.difference != 0))
+            inventory.difference_count = counts.get(inventory._origin, 0)
     
     @api.model
     def create(self, vals):
@@ -177,54 +155,93 @@ class BrandatStockInventory(models.Model):
             vals['name'] = self.env['ir.sequence'].next_by_code('brandat.stock.inventory') or 'New'
         return super().create(vals)
     
+    def _get_scope_filter(self):
+        """شرط SQL إضافي لسجلات المخزون حسب نطاق الجرد"""
+        if self.scope == 'products':
+            if not self.product_ids:
+                raise ValidationError('يجب اختيار المنتجات المطلوب جردها!')
+            return "AND s.product_id IN %(product_ids)s", {'product_ids': tuple(self.product_ids.ids)}
+        
+        if self.scope == 'changed':
+            last_count = self.search([
+                ('store_id', '=', self.store_id.id),
+                ('state', '=', 'done'),
+                ('id', '!=', self.id),
+            ], order='validated_date desc nulls last, date desc', limit=1)
+            if last_count:
+                # الجرد المطبق قبل إضافة تاريخ التطبيق يرجع لتاريخه
+                since = last_count.validated_date or last_count.date
+                return "AND s.write_date > %(last_count_date)s", {'last_count_date': since}
+        
+        return "", {}
+    
     def action_start(self):
-        """بدء الجرد - جلب المخزون الحالي"""
+        """بدء الجرد - جلب المخزون الحالي بإدخال جماعي واحد"""
         self.ensure_one()
         
         # حذف الأسطر القديمة
         self.line_ids.unlink()
         
-        # جلب كل المخزون في الفرع
-        stocks = self.env['brandat.stock'].search([('store_id', '=', self.store_id.id)])
-        
-        # إنشاء أسطر الجرد
-        for stock in stocks:
-            self.env['brandat.stock.inventory.line'].create({
-                'inventory_id': self.id,
-                'product_id': stock.product_id.id,
-                'size_id': stock.size_id.id,
-                'color_id': stock.color_id.id,
-                'theoretical_qty': stock.quantity,
-                'real_qty': stock.quantity,  # سيتم تعديلها يدوياً
-            })
+        # إنشاء أسطر الجرد مباشرة من المخزون في الفرع (INSERT ... SELECT)
+        scope_filter, params = self._get_scope_filter()
+        params.update({
+            'inventory_id': self.id,
+            'store_id': self.store_id.id,
+            'uid': self.env.uid,
+        })
+        self.env['brandat.stock'].flush_model()
+        self.env.cr.execute(f"""
+            INSERT INTO brandat_stock_inventory_line (
+                inventory_id, product_id, size_id, color_id,
+                theoretical_qty, real_qty, difference,
+                create_uid, create_date, write_uid, write_date
+            )
+            SELECT %(inventory_id)s, s.product_id, s.size_id, s.color_id,
+                   s.quantity, s.quantity, 0,
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+            FROM brandat_stock s
+            WHERE s.store_id = %(store_id)s {scope_filter}
+            ORDER BY s.product_id, s.size_id, s.color_id
+        """, params)
+        line_count = self.env.cr.rowcount
+        self.env['brandat.stock.inventory.line'].invalidate_model()
+        self.invalidate_recordset(['line_ids'])
         
         self.state = 'in_progress'
         
         self.message_post(
-            body=f'تم بدء الجرد للفرع {self.store_id.name}',
+            body=f'تم بدء الجرد للفرع {self.store_id.name}\nعدد الأسطر: {line_count}',
             subject='بدء الجرد'
         )
     
     def action_validate(self):
-        """تطبيق الجرد - تعديل المخزون"""
+        """تطبيق الجرد - تعديل المخزون بتحديث جماعي واحد"""
         self.ensure_one()
         
         if self.state != 'in_progress':
             raise ValidationError('يجب أن يكون الجرد في حالة "جاري الجرد"!')
         
-        for line in self.line_ids:
-            if line.difference != 0:
-                stock = self.env['brandat.stock'].search([
-                    ('store_id', '=', self.store_id.id),
-                    ('product_id', '=', line.product_id.id),
-                    ('size_id', '=', line.size_id.id),
-                    ('color_id', '=', line.color_id.id),
-                ], limit=1)
-                
-                if stock:
-                    stock.quantity = line.real_qty
+        self.env['brandat.stock.inventory.line'].flush_model()
+        self.env.cr.execute("""
+            SELECT product_id, size_id, color_id, real_qty
+            FROM brandat_stock_inventory_line
+            WHERE inventory_id = %s AND difference != 0
+        """, [self.id])
+        counted = {
+            (self.store_id.id, product_id, size_id, color_id): real_qty
+            for product_id, size_id, color_id, real_qty in self.env.cr.fetchall()
+        }
+        
+        # الفرق يحسب من الكمية الحالية المقفولة لأن المخزون قد يتغير أثناء الجرد
+        Stock = self.env['brandat.stock']
+        current = Stock._lock_stock_rows(counted)
+        Stock._apply_stock_moves([
+            key + (real_qty - (current[key][1] if key in current else 0),)
+            for key, real_qty in counted.items()
+        ], move_type='inventory', origin=self)
         
-        self.state = 'done'
+        # بعد تعديل المخزون، حتى لا تعتبر تعديلات الجرد نفسه تغييراً في الجرد التالي
+        self.write({'state': 'done', 'validated_date': fields.Datetime.now()})
         
         self.message_post(
             body=f'تم إكمال الجرد للفرع {self.store_id.name}\nعدد الفروقات: {self.difference_count}',
@@ -241,7 +258,7 @@ class BrandatStockInventoryLine(models.Model):
     _name = 'brandat.stock.inventory.line'
     _description = 'Stock Inventory Line'
     
-    inventory_id = fields.Many2one('brandat.stock.inventory', string='الجرد', ondelete='cascade', required=True)
+    inventory_id = fields.Many2one('brandat.stock.inventory', string='الجرد', ondelete='cascade', required=True, index=True)
     product_id = fields.Many2one('brandat.product', string='المنتج', required=True)
     size_id = fields.Many2one('brandat.size', string='المقاس', required=True)
     color_id = fields.Many2one('brandat.color', string='اللون', required=True)
@@ -265,41 +282,135 @@ class BrandatStockAlert(models.Model):
     min_quantity = fields.Integer(string='الحد الأدنى', required=True, default=10)
     active = fields.Boolean(string='نشط', default=True)
     
+    # حالة التنبيه من آخر فحص (لإرسال الإشعار عند بداية النقص أو انتهائه فقط)
+    is_breached = fields.Boolean(string='تحت الحد الأدنى', readonly=True)
+    breach_date = fields.Datetime(string='بداية النقص', readonly=True)
+    last_quantity = fields.Integer(string='الكمية عند آخر فحص', readonly=True)
+    last_check_date = fields.Datetime(string='آخر فحص', readonly=True)
+    
+    # من جدول معدلات البيع المحسوب ليلياً
+    daily_velocity = fields.Float(string='معدل البيع اليومي', compute='_compute_velocity', digits=(16, 2))
+    days_of_cover = fields.Float(string='أيام التغطية', compute='_compute_velocity', digits=(16, 1))
+    
     _sql_constraints = [
         ('product_store_unique', 'unique(product_id, store_id)', 
          'يوجد تنبيه بالفعل لهذا المنتج في هذا الفرع!')
     ]
     
+    def _compute_velocity(self):
+        velocities = self.env['brandat.stock.velocity']._get_velocity_by_product_store(
+            self.product_id.ids, self.store_id.ids)
+        for alert in self:
+            velocity = velocities.get((alert.product_id.id, alert.store_id.id), (0.0, 0))[0]
+            alert.daily_velocity = velocity
+            alert.days_of_cover = max(alert.last_quantity, 0) / velocity if velocity else 0.0
+    
     @api.model
-    def _check_stock_alerts(self):
-        """دالة تشغل تلقائياً للتحقق من المخزون"""
-        alerts = self.search([('active', '=', True)])
+    def _check_stock_alerts(self, changed_only=False):
+        """دالة تشغل تلقائياً للتحقق من المخزون
         
-        for alert in alerts:
-            stocks = self.env['brandat.stock'].search([
-                ('product_id', '=', alert.product_id.id),
-                ('store_id', '=', alert.store_id.id),
-            ])
-            
-            total_qty = sum(stocks.mapped('quantity'))
-            
-            if total_qty < alert.min_quantity:
-                # إرسال إشعار
-                message = f"""
+        يتم حساب كل التنبيهات باستعلام تجميعي واحد، ومع changed_only=True يتم فحص
+        أزواج (المنتج، الفرع) التي تغير مخزونها أو حدها الأدنى منذ آخر فحص فقط.
+        كل تعديل للمخزون (بما فيه جمل SQL المباشرة) يحدث write_date، وعلامة آخر فحص
+        تحفظ من بداية الفحص ناقص هامش تداخل.
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        last_check = params.get_param('brandat_product.stock_alert_last_check')
+        now = self.env.cr.now()
+        
+        changed_filter = ""
+        if changed_only and last_check:
+            changed_filter = """
+              AND (a.write_date > %(last_check)s OR EXISTS (
+                    SELECT 1 FROM brandat_stock c
+                    WHERE c.product_id = a.product_id
+                      AND c.store_id = a.store_id
+                      AND c.write_date > %(last_check)s))
+            """
+        
+        self.env['brandat.stock'].flush_model(['product_id', 'store_id', 'quantity'])
+        self.flush_model()
+        self.env.cr.execute(f"""
+            SELECT a.id, a.min_quantity, a.is_breached, a.last_quantity,
+                   COALESCE(SUM(s.quantity), 0) AS total_qty
+            FROM brandat_stock_alert a
+            LEFT JOIN brandat_stock s
+                   ON s.product_id = a.product_id AND s.store_id = a.store_id
+            WHERE a.active {changed_filter}
+            GROUP BY a.id
+        """, {'last_check': last_check})
+        results = self.env.cr.fetchall()
+        
+        started, cleared, updates = [], [], []
+        for alert_id, min_quantity, was_breached, last_quantity, total_qty in results:
+            breached = total_qty < min_quantity
+            if breached and not was_breached:
+                started.append(alert_id)
+            elif was_breached and not breached:
+                cleared.append(alert_id)
+            if breached != bool(was_breached) or total_qty != last_quantity:
+                updates.append((alert_id, breached, total_qty))
+        
+        if updates:
+            self.env.cr.execute("""
+                UPDATE brandat_stock_alert a
+                SET is_breached = v.breached,
+                    last_quantity = v.total_qty,
+                    breach_date = CASE
+                        WHEN v.breached AND NOT COALESCE(a.is_breached, false) THEN %s
+                        WHEN v.breached THEN a.breach_date
+                    END
+                FROM unnest(%s::int[], %s::bool[], %s::int[]) AS v(id, breached, total_qty)
+                WHERE a.id = v.id
+            """, [now, [u[0] for u in updates], [u[1] for u in updates], [u[2] for u in updates]])
+        if results:
+            self.env.cr.execute("""
+                UPDATE brandat_stock_alert SET last_check_date = %s WHERE id = ANY(%s)
+            """, [now, [row[0] for row in results]])
+            self.browse(row[0] for row in results).invalidate_recordset(
+                ['is_breached', 'breach_date', 'last_quantity', 'last_check_date'])
+        
+        self._notify_stock_alerts(self.browse(started), self.browse(cleared))
+        params.set_param('brandat_product.stock_alert_last_check',
+                         fields.Datetime.to_string(now - STOCK_ALERT_CHECK_OVERLAP))
+    
+    def _notify_stock_alerts(self, started, cleared):
+        """إنشاء إشعارات بداية وانتهاء النقص دفعة واحدة"""
+        values = []
+        for alert in started:
+            values.append({
+                'model': self._name,
+                'res_id': alert.id,
+                'message_type': 'notification',
+                'body': f"""
                     <p><strong>تنبيه نقص مخزون</strong></p>
                     <ul>
                         <li>المنتج: {alert.product_id.name}</li>
                         <li>الفرع: {alert.store_id.name}</li>
-                        <li>الكمية الحالية: {total_qty}</li>
+                        <li>الكمية الحالية: {alert.last_quantity}</li>
                         <li>الحد الأدنى: {alert.min_quantity}</li>
                     </ul>
-                """
-                
-                self.env['mail.message'].create({
-                    'message_type': 'notification',
-                    'body': message,
-                    'subject': f'تنبيه: نقص مخزون {alert.product_id.name}',
-                })
+                """,
+                'subject': f'تنبيه: نقص مخزون {alert.product_id.name}',
+            })
+        for alert in cleared:
+            values.append({
+                'model': self._name,
+                'res_id': alert.id,
+                'message_type': 'notification',
+                'body': f"""
+                    <p><strong>انتهاء نقص المخزون</strong></p>
+                    <ul>
+                        <li>المنتج: {alert.product_id.name}</li>
+                        <li>الفرع: {alert.store_id.name}</li>
+                        <li>الكمية الحالية: {alert.last_quantity}</li>
+                        <li>الحد الأدنى: {alert.min_quantity}</li>
+                    </ul>
+                """,
+                'subject': f'انتهاء نقص مخزون {alert.product_id.name}',
+            })
+        if values:
+            self.env['mail.message'].create(values)
 
 
 # إضافة حقول جديدة لموديل المخزون
@@ -313,6 +424,10 @@ class BrandatStock(models.Model):
         ('out', 'نفذ')
     ], string='الحالة', compute='_compute_state', store=True)
     
+    def init(self):
+        # فهرس لعدادات حالات المخزون في لوحة التحكم (إجمالي ولكل فرع)
+        tools.create_index(self.env.cr, 'brandat_stock_state_store_index', self._table, ['state', 'store_id'])
+    
     @api.depends('quantity', 'min_quantity')
     def _compute_state(self):
         for stock in self:
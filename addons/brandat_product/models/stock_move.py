@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from odoo import models, fields, api, tools
+
+# مفتاح سجل المخزون في كل الجداول: (الفرع، المنتج، المقاس، اللون)
+STOCK_KEY_COLUMNS = ['store_id', 'product_id', 'size_id', 'color_id']
+
+# وقت القطع للقطة متأخر عن الآن بهذا الهامش، وهو أطول من أي معاملة (limit_time_real)
+# حتى تكون كل الحركات المؤرخة قبله قد تم حفظها
+SNAPSHOT_SAFETY_MARGIN = timedelta(hours=1)
+
+# اللقطات الأحدث من هذه المدة تبقى كلها، والأقدم تبقى منها أول لقطة في كل شهر فقط
+SNAPSHOT_DAILY_RETENTION_DAYS = 30
+
+
+class BrandatStockMove(models.Model):
+    _name = 'brandat.stock.move'
+    _description = 'Stock Movement Ledger'
+    _order = 'date desc, id desc'
+
+    date = fields.Datetime(string='التاريخ', required=True, readonly=True)
+    store_id = fields.Many2one('brandat.store', string='الفرع', required=True, readonly=True)
+    product_id = fields.Many2one('brandat.product', string='المنتج', required=True, readonly=True)
+    size_id = fields.Many2one('brandat.size', string='المقاس', required=True, readonly=True)
+    color_id = fields.Many2one('brandat.color', string='اللون', required=True, readonly=True)
+    quantity = fields.Integer(string='الكمية', readonly=True)
+    move_type = fields.Selection([
+        ('sale', 'بيع'),
+        ('purchase', 'شراء'),
+        ('transfer_out', 'تحويل صادر'),
+        ('transfer_in', 'تحويل وارد'),
+        ('return', 'مرتجع / استبدال'),
+        ('inventory', 'جرد'),
+        ('adjust', 'تسوية'),
+    ], string='نوع الحركة', required=True, readonly=True)
+    reference = fields.Char(string='المرجع', readonly=True)
+    res_model = fields.Char(string='نوع المستند', readonly=True)
+    res_id = fields.Integer(string='رقم المستند', readonly=True)
+
+    def init(self):
+        tools.create_index(self.env.cr, 'brandat_stock_move_key_date_index', self._table,
+                           STOCK_KEY_COLUMNS + ['date'])
+        tools.create_index(self.env.cr, 'brandat_stock_move_date_index', self._table, ['date'])
+
+    @api.model
+    def _record_moves(self, deltas, move_type='adjust', origin=None):
+        """تسجيل حركات المخزون المطبقة في السجل بإدخال واحد - deltas: {المفتاح: الكمية}
+
+        تاريخ الحركة هو وقت تنفيذها الفعلي (clock_timestamp) وليس بداية المعاملة
+        """
+        if not deltas:
+            return
+        keys = list(deltas)
+        self.env.cr.execute("""
+            INSERT INTO brandat_stock_move (
+                date, store_id, product_id, size_id, color_id, quantity,
+                move_type, reference, res_model, res_id,
+                create_uid, create_date, write_uid, write_date
+            )
+            SELECT clock_timestamp() at time zone 'UTC', v.store_id, v.product_id, v.size_id, v.color_id, v.quantity,
+                   %(move_type)s, %(reference)s, %(res_model)s, %(res_id)s,
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+            FROM unnest(%(store_ids)s::int[], %(product_ids)s::int[], %(size_ids)s::int[],
+                        %(color_ids)s::int[], %(quantities)s::int[])
+                 AS v(store_id, product_id, size_id, color_id, quantity)
+        """, {
+            'move_type': move_type,
+            'reference': origin.display_name if origin else None,
+            'res_model': origin._name if origin else None,
+            'res_id': origin.id if origin else None,
+            'uid': self.env.uid,
+            'store_ids': [key[0] for key in keys],
+            'product_ids': [key[1] for key in keys],
+            'size_ids': [key[2] for key in keys],
+            'color_ids': [key[3] for key in keys],
+            'quantities': list(deltas.values()),
+        })
+
+    @api.model
+    def _stock_at_query(self, date, store_ids=None, product_ids=None):
+        """استعلام المخزون في تاريخ معين: أقرب لقطة قبل التاريخ + الحركات بعدها فقط"""
+        snapshot = self.env['brandat.stock.snapshot'].search([('date', '<=', date)], order='date desc', limit=1)
+        params = {
+            'snapshot_id': snapshot.id or 0,
+            'since': snapshot.date or '1970-01-01',
+            'date': date,
+        }
+        filters = ""
+        if store_ids:
+            filters += " AND store_id IN %(store_ids)s"
+            params['store_ids'] = tuple(store_ids)
+        if product_ids:
+            filters += " AND product_id IN %(product_ids)s"
+            params['product_ids'] = tuple(product_ids)
+
+        self.flush_model()
+        query = f"""
+            SELECT store_id, product_id, size_id, color_id, SUM(quantity) AS quantity
+            FROM (
+                SELECT store_id, product_id, size_id, color_id, quantity
+                FROM brandat_stock_snapshot_line
+                WHERE snapshot_id = %(snapshot_id)s {filters}
+                UNION ALL
+                SELECT store_id, product_id, size_id, color_id, quantity
+                FROM brandat_stock_move
+                WHERE date > %(since)s AND date <= %(date)s {filters}
+            ) stock
+            GROUP BY store_id, product_id, size_id, color_id
+            HAVING SUM(quantity) != 0
+        """
+        return query, params
+
+    @api.model
+    def get_stock_at(self, date, store_ids=None, product_ids=None):
+        """المخزون في تاريخ معين - يرجع {(الفرع، المنتج، المقاس، اللون): الكمية}"""
+        query, params = self._stock_at_query(date, store_ids, product_ids)
+        self.env.cr.execute(query, params)
+        return {
+            (store_id, product_id, size_id, color_id): quantity
+            for store_id, product_id, size_id, color_id, quantity in self.env.cr.fetchall()
+        }
+
+    @api.model
+    def get_stock_valuation(self, date, store_ids=None, product_ids=None):
+        """قيمة المخزون لكل فرع في تاريخ معين (بسعر المنتج الحالي)"""
+        query, params = self._stock_at_query(date, store_ids, product_ids)
+        self.env['brandat.product'].flush_model(['price'])
+        self.env.cr.execute(f"""
+            WITH stock AS ({query})
+            SELECT st.id, st.name, COALESCE(SUM(stock.quantity), 0), COALESCE(SUM(stock.quantity * p.price), 0)
+            FROM stock
+            JOIN brandat_store st ON st.id = stock.store_id
+            JOIN brandat_product p ON p.id = stock.product_id
+            GROUP BY st.id, st.name
+            ORDER BY st.name
+        """, params)
+        return [
+            {'id': store_id, 'name': name, 'quantity': quantity, 'value': value}
+            for store_id, name, quantity, value in self.env.cr.fetchall()
+        ]
+
+    @api.model
+    def get_move_history(self, store_id=None, product_id=None, date_from=None, date_to=None, limit=None):
+        """سجل حركات المخزون لفرع أو منتج خلال فترة"""
+        domain = []
+        if store_id:
+            domain.append(('store_id', '=', store_id))
+        if product_id:
+            domain.append(('product_id', '=', product_id))
+        if date_from:
+            domain.append(('date', '>=', date_from))
+        if date_to:
+            domain.append(('date', '<=', date_to))
+        return self.search_read(domain, [
+            'date', 'store_id', 'product_id', 'size_id', 'color_id',
+            'quantity', 'move_type', 'reference',
+        ], limit=limit)
+
+
+class BrandatStockSnapshot(models.Model):
+    _name = 'brandat.stock.snapshot'
+    _description = 'Stock Snapshot'
+    _order = 'date desc'
+
+    date = fields.Datetime(string='التاريخ', required=True, readonly=True, index=True)
+    line_ids = fields.One2many('brandat.stock.snapshot.line', 'snapshot_id', string='الأسطر', readonly=True)
+    line_count = fields.Integer(string='عدد الأسطر', readonly=True)
+
+    @api.model
+    def _create_snapshot(self):
+        """لقطة جديدة من سجل الحركات: اللقطة السابقة + الحركات حتى وقت القطع
+
+        اللقطة لا تقرأ جدول المخزون الحالي، فلا تتأثر بالمعاملات التي لم تحفظ بعد وقت تشغيلها،
+        وتبقى دائماً مطابقة لما يحسبه _stock_at_query من نفس السجل
+        """
+        previous = self.search([], order='date desc', limit=1)
+        if not previous:
+            return self._create_opening_snapshot()
+
+        cutoff = self.env.cr.now() - SNAPSHOT_SAFETY_MARGIN
+        if cutoff <= previous.date:
+            return previous
+
+        self.env['brandat.stock.move'].flush_model()
+        snapshot = self.create({'date': cutoff})
+        self.env.cr.execute("""
+            INSERT INTO brandat_stock_snapshot_line (snapshot_id, store_id, product_id, size_id, color_id, quantity)
+            SELECT %(snapshot_id)s, store_id, product_id, size_id, color_id, SUM(quantity)
+            FROM (
+                SELECT store_id, product_id, size_id, color_id, quantity
+                FROM brandat_stock_snapshot_line
+                WHERE snapshot_id = %(previous_id)s
+                UNION ALL
+                SELECT store_id, product_id, size_id, color_id, quantity
+                FROM brandat_stock_move
+                WHERE date > %(since)s AND date <= %(cutoff)s
+            ) stock
+            GROUP BY store_id, product_id, size_id, color_id
+            HAVING SUM(quantity) != 0
+        """, {'snapshot_id': snapshot.id, 'previous_id': previous.id, 'since': previous.date, 'cutoff': cutoff})
+        snapshot.line_count = self.env.cr.rowcount
+        return snapshot
+
+    @api.model
+    def _create_opening_snapshot(self):
+        """اللقطة الأولى (رصيد أول المدة) من المخزون الحالي - تنشأ عند الترقية قبل تسجيل أي حركات"""
+        self.env['brandat.stock'].flush_model()
+        snapshot = self.create({'date': self.env.cr.now()})
+        self.env.cr.execute("""
+            INSERT INTO brandat_stock_snapshot_line (snapshot_id, store_id, product_id, size_id, color_id, quantity)
+            SELECT %s, store_id, product_id, size_id, color_id, quantity
+            FROM brandat_stock
+            WHERE quantity != 0
+        """, [snapshot.id])
+        snapshot.line_count = self.env.cr.rowcount
+        return snapshot
+
+    @api.model
+    def _cleanup_snapshots(self):
+        """حذف اللقطات القديمة مع الإبقاء على أول لقطة في كل شهر كنقطة بداية للاستعلامات القديمة"""
+        self.flush_model()
+        self.env.cr.execute("""
+            DELETE FROM brandat_stock_snapshot
+            WHERE date < %s
+              AND id NOT IN (
+                  SELECT DISTINCT ON (date_trunc('month', date)) id
+                  FROM brandat_stock_snapshot
+                  ORDER BY date_trunc('month', date), date
+              )
+        """, [self.env.cr.now() - timedelta(days=SNAPSHOT_DAILY_RETENTION_DAYS)])
+        self.invalidate_model()
+        self.env['brandat.stock.snapshot.line'].invalidate_model()
+
+    @api.model
+    def _cron_create_snapshot(self):
+        self._create_snapshot()
+        self._cleanup_snapshots()
+
+
+class BrandatStockSnapshotLine(models.Model):
+    _name = 'brandat.stock.snapshot.line'
+    _description = 'Stock Snapshot Line'
+    _log_access = False
+
+    snapshot_id = fields.Many2one('brandat.stock.snapshot', string='اللقطة', required=True, ondelete='cascade')
+    store_id = fields.Many2one('brandat.store', string='الفرع', required=True)
+    product_id = fields.Many2one('brandat.product', string='المنتج', required=True)
+    size_id = fields.Many2one('brandat.size', string='المقاس', required=True)
+    color_id = fields.Many2one('brandat.color', string='اللون', required=True)
+    quantity = fields.Integer(string='الكمية')
+
+    def init(self):
+        tools.create_index(self.env.cr, 'brandat_stock_snapshot_line_key_index', self._table,
+                           ['snapshot_id'] + STOCK_KEY_COLUMNS)
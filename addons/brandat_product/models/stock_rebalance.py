@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import math
+from collections import defaultdict
+
+from odoo import models, fields, api
+from odoo.exceptions import ValidationError
+
+
+class BrandatStockRebalanceWizard(models.TransientModel):
+    _name = 'brandat.stock.rebalance.wizard'
+    _description = 'Stock Rebalancing Planner'
+
+    store_ids = fields.Many2many('brandat.store', string='الفروع',
+                                 help='اتركه فارغاً لإعادة التوزيع بين كل الفروع')
+    product_ids = fields.Many2many('brandat.product', string='المنتجات',
+                                   help='اتركه فارغاً لكل المنتجات')
+    target_cover_days = fields.Integer(string='أيام التغطية المستهدفة', required=True,
+                                       default=lambda self: self.env['brandat.stock.velocity']._get_target_cover_days())
+    keep_qty = fields.Integer(string='الحد الأدنى المحتفظ به', default=1,
+                              help='أقل كمية تبقى في الفرع المرسل لكل صنف حتى لو لم يكن عليه طلب')
+    min_transfer_qty = fields.Integer(string='أقل كمية للتحويل', default=1)
+
+    def _load_matrix(self):
+        """تحميل مصفوفة (الفرع × الصنف) بالمخزون الحالي ومعدل البيع باستعلام واحد"""
+        self.env['brandat.stock'].flush_model(['store_id', 'product_id', 'size_id', 'color_id', 'quantity'])
+        self.env['brandat.stock.velocity'].flush_model()
+
+        filters = ""
+        params = {}
+        if self.store_ids:
+            filters += " AND store_id IN %(store_ids)s"
+            params['store_ids'] = tuple(self.store_ids.ids)
+        if self.product_ids:
+            filters += " AND product_id IN %(product_ids)s"
+            params['product_ids'] = tuple(self.product_ids.ids)
+
+        self.env.cr.execute(f"""
+            WITH st AS (
+                SELECT store_id, product_id, size_id, color_id, quantity
+                FROM brandat_stock
+                WHERE quantity > 0 {filters}
+            ),
+            v AS (
+                SELECT store_id, product_id, size_id, color_id, daily_velocity
+                FROM brandat_stock_velocity
+                WHERE daily_velocity > 0 {filters}
+            )
+            SELECT COALESCE(st.product_id, v.product_id),
+                   COALESCE(st.size_id, v.size_id),
+                   COALESCE(st.color_id, v.color_id),
+                   COALESCE(st.store_id, v.store_id),
+                   COALESCE(st.quantity, 0),
+                   COALESCE(v.daily_velocity, 0)
+            FROM st
+            FULL OUTER JOIN v
+                 ON v.store_id = st.store_id AND v.product_id = st.product_id
+                AND v.size_id = st.size_id AND v.color_id = st.color_id
+        """, params)
+        return self.env.cr.fetchall()
+
+    def _plan_transfers(self, matrix):
+        """مطابقة الفائض مع العجز لكل صنف بطريقة جشعة (الأكبر مع الأكبر)
+
+        الطلب في كل فرع = معدل البيع اليومي × أيام التغطية المستهدفة
+        يرجع {(من فرع، إلى فرع): [(المنتج، المقاس، اللون، الكمية)]}
+        """
+        variants = defaultdict(lambda: ([], []))
+        for product_id, size_id, color_id, store_id, on_hand, velocity in matrix:
+            demand = math.ceil(velocity * self.target_cover_days)
+            surpluses, deficits = variants[product_id, size_id, color_id]
+            if on_hand < demand:
+                deficits.append([demand - on_hand, store_id])
+            else:
+                surplus = on_hand - max(demand, self.keep_qty)
+                if surplus > 0:
+                    surpluses.append([surplus, store_id])
+
+        min_qty = max(self.min_transfer_qty, 1)
+        plan = defaultdict(list)
+        for variant, (surpluses, deficits) in variants.items():
+            if not surpluses or not deficits:
+                continue
+            surpluses.sort(reverse=True)
+            deficits.sort(reverse=True)
+            i = j = 0
+            while i < len(surpluses) and j < len(deficits):
+                qty = min(surpluses[i][0], deficits[j][0])
+                if qty >= min_qty:
+                    plan[surpluses[i][1], deficits[j][1]].append(variant + (qty,))
+                surpluses[i][0] -= qty
+                deficits[j][0] -= qty
+                if surpluses[i][0] == 0:
+                    i += 1
+                if deficits[j][0] == 0:
+                    j += 1
+        return plan
+
+    def action_generate(self):
+        """إنشاء تحويلات مسودة بالأسطر المقترحة - تحويل واحد لكل (من فرع، إلى فرع)"""
+        self.ensure_one()
+        if self.target_cover_days <= 0:
+            raise ValidationError('أيام التغطية المستهدفة يجب أن تكون أكبر من صفر!')
+
+        plan = self._plan_transfers(self._load_matrix())
+        if not plan:
+            raise ValidationError('لا توجد تحويلات مقترحة - المخزون موزع بالفعل حسب الطلب!')
+
+        transfers = self.env['brandat.stock.transfer'].create([{
+            'store_from_id': store_from_id,
+            'store_to_id': store_to_id,
+            'notes': f'تحويل مقترح لإعادة التوزيع (تغطية {self.target_cover_days} يوم)',
+            'line_ids': [(0, 0, {
+                'product_id': product_id,
+                'size_id': size_id,
+                'color_id': color_id,
+                'quantity': qty,
+            }) for product_id, size_id, color_id, qty in lines],
+        } for (store_from_id, store_to_id), lines in plan.items()])
+
+        return {
+            'name': 'تحويلات إعادة التوزيع',
+            'type': 'ir.actions.act_window',
+            'res_model': 'brandat.stock.transfer',
+            'view_mode': 'list,form',
+            'domain': [('id', 'in', transfers.ids)],
+        }
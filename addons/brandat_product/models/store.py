@@ -6,4 +6,5 @@ class BrandatStore(models.Model):
     
     name = fields.Char(string='اسم الفرع', required=True)
     code = fields.Char(string='كود الفرع')
-    address = fields.Text(string='العنوان')
\ No newline at end of file
+    address = fields.Text(string='العنوان')
+    active = fields.Boolean(string='نشط', default=True)
\ No newline at end of file
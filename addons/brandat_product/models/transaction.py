@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
+from collections import defaultdict
 
 class BrandatTransaction(models.Model):
     _name = 'brandat.transaction'
@@ -55,7 +56,48 @@ class BrandatTransaction(models.Model):
     def create(self, vals):
         if vals.get('name', 'New') == 'New':
             vals['name'] = self.env['ir.sequence'].next_by_code('brandat.transaction') or 'New'
-        return super(BrandatTransaction, self).create(vals)
+        transaction = super(BrandatTransaction, self).create(vals)
+        transaction._update_treasury_totals({})
+        return transaction
+    
+    def write(self, vals):
+        tracked = bool({'state', 'amount', 'transaction_type', 'treasury_id'} & set(vals))
+        before = self._get_treasury_contributions() if tracked else None
+        res = super(BrandatTransaction, self).write(vals)
+        if tracked:
+            self._update_treasury_totals(before)
+        return res
+    
+    def unlink(self):
+        before = self._get_treasury_contributions()
+        res = super(BrandatTransaction, self).unlink()
+        self.env['brandat.transaction']._apply_treasury_changes(before, {})
+        return res
+    
+    def _get_treasury_contributions(self):
+        """مساهمة المعاملات المؤكدة في الخزائن: {(treasury_id, الحقل): المبلغ}"""
+        contributions = defaultdict(float)
+        for transaction in self:
+            if transaction.state != 'confirmed' or not transaction.treasury_id:
+                continue
+            if transaction.transaction_type == 'income':
+                contributions[(transaction.treasury_id.id, 'transaction_income')] += transaction.amount
+            elif transaction.transaction_type == 'expense':
+                contributions[(transaction.treasury_id.id, 'transaction_expense')] += transaction.amount
+        return contributions
+    
+    def _update_treasury_totals(self, before):
+        self._apply_treasury_changes(before, self._get_treasury_contributions())
+    
+    @api.model
+    def _apply_treasury_changes(self, before, after):
+        """تطبيق الفرق بين المساهمة قبل وبعد التعديل على أرصدة الخزائن"""
+        deltas = defaultdict(dict)
+        for key in set(before) | set(after):
+            treasury_id, field_name = key
+            deltas[field_name][treasury_id] = after.get(key, 0.0) - before.get(key, 0.0)
+        for field_name, treasury_deltas in deltas.items():
+            self.env['brandat.treasury']._add_treasury_totals(field_name, treasury_deltas)
     
     def action_confirm(self):
         """تأكيد المعاملة"""
@@ -2,6 +2,7 @@
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
 from datetime import datetime, timedelta
+from collections import defaultdict
 
 class BrandatTreasury(models.Model):
     _name = 'brandat.treasury'
@@ -19,11 +20,13 @@ class BrandatTreasury(models.Model):
     opening_balance = fields.Float(string='رصيد الافتتاح', tracking=True)
     closing_balance = fields.Float(string='رصيد الإقفال', compute='_compute_closing_balance', store=True)
     
-    # الحركات
+    # الحركات - أرصدة جارية تحدث بالفرق (delta) عند تأكيد/إلغاء المستندات
     total_income = fields.Float(string='إجمالي الإيرادات', compute='_compute_totals', store=True)
     total_expense = fields.Float(string='إجمالي المصروفات', compute='_compute_totals', store=True)
-    total_sales = fields.Float(string='إجمالي المبيعات', compute='_compute_totals', store=True)
-    total_purchases = fields.Float(string='إجمالي المشتريات', compute='_compute_totals', store=True)
+    total_sales = fields.Float(string='إجمالي المبيعات', readonly=True)
+    total_purchases = fields.Float(string='إجمالي المشتريات', readonly=True)
+    transaction_income = fields.Float(string='إيرادات المعاملات', readonly=True)
+    transaction_expense = fields.Float(string='مصروفات المعاملات', readonly=True)
     
     # العلاقات
     transaction_ids = fields.One2many('brandat.transaction', 'treasury_id', string='المعاملات')
@@ -53,35 +56,134 @@ class BrandatTreasury(models.Model):
         if last_treasury:
             vals['opening_balance'] = last_treasury.closing_balance
         
-        return super(BrandatTreasury, self).create(vals)
+        treasury = super(BrandatTreasury, self).create(vals)
+        treasury._reconcile_totals()
+        return treasury
     
-    @api.depends('transaction_ids.amount', 'transaction_ids.transaction_type')
+    @api.depends('total_sales', 'total_purchases', 'transaction_income', 'transaction_expense')
     def _compute_totals(self):
         for treasury in self:
-            # المبيعات
-            sales = self.env['brandat.sale'].search([
-                ('store_id', '=', treasury.store_id.id),
-                ('date', '>=', treasury.date),
-                ('date', '<', treasury.date + timedelta(days=1)),
-                ('state', '=', 'confirmed'),
-            ])
-            treasury.total_sales = sum(sales.mapped('amount_total'))
-            
-            # المشتريات
-            purchases = self.env['brandat.purchase'].search([
-                ('store_id', '=', treasury.store_id.id),
-                ('date', '>=', treasury.date),
-                ('date', '<', treasury.date + timedelta(days=1)),
-                ('state', '=', 'confirmed'),
-            ])
-            treasury.total_purchases = sum(purchases.mapped('amount_total'))
-            
-            # الإيرادات والمصروفات من المعاملات
-            income_transactions = treasury.transaction_ids.filtered(lambda t: t.transaction_type == 'income')
-            expense_transactions = treasury.transaction_ids.filtered(lambda t: t.transaction_type == 'expense')
-            
-            treasury.total_income = sum(income_transactions.mapped('amount')) + treasury.total_sales
-            treasury.total_expense = sum(expense_transactions.mapped('amount')) + treasury.total_purchases
+            treasury.total_income = treasury.transaction_income + treasury.total_sales
+            treasury.total_expense = treasury.transaction_expense + treasury.total_purchases
+    
+    # الحقول التي تحدث بالفرق فقط
+    INCREMENTAL_FIELDS = ('total_sales', 'total_purchases', 'transaction_income', 'transaction_expense')
+    
+    @api.model
+    def _add_store_day_totals(self, field_name, entries):
+        """إضافة فرق المبيعات أو المشتريات لخزينة الفرع في يوم المستند
+        
+        entries: قائمة (store_id, date, amount)
+        """
+        assert field_name in ('total_sales', 'total_purchases')
+        deltas = defaultdict(float)
+        for store_id, date, amount in entries:
+            if store_id and date and amount:
+                deltas[(store_id, fields.Date.to_date(date))] += amount
+        if not deltas:
+            return
+        
+        self.flush_model([field_name])
+        self.env.cr.execute(f"""
+            UPDATE brandat_treasury t
+            SET {field_name} = t.{field_name} + v.delta
+            FROM unnest(%s::int[], %s::date[], %s::float8[]) AS v(store_id, date, delta)
+            WHERE t.store_id = v.store_id AND t.date = v.date
+            RETURNING t.id
+        """, [
+            [store_id for store_id, _date in deltas],
+            [date for _store_id, date in deltas],
+            list(deltas.values()),
+        ])
+        self._totals_updated([row[0] for row in self.env.cr.fetchall()], [field_name])
+    
+    @api.model
+    def _add_treasury_totals(self, field_name, deltas):
+        """إضافة فرق إيرادات أو مصروفات المعاملات - deltas: {treasury_id: amount}"""
+        assert field_name in ('transaction_income', 'transaction_expense')
+        deltas = {treasury_id: amount for treasury_id, amount in deltas.items() if amount}
+        if not deltas:
+            return
+        
+        self.flush_model([field_name])
+        self.env.cr.execute(f"""
+            UPDATE brandat_treasury t
+            SET {field_name} = t.{field_name} + v.delta
+            FROM unnest(%s::int[], %s::float8[]) AS v(id, delta)
+            WHERE t.id = v.id
+            RETURNING t.id
+        """, [list(deltas), list(deltas.values())])
+        self._totals_updated([row[0] for row in self.env.cr.fetchall()], [field_name])
+    
+    @api.model
+    def _totals_updated(self, treasury_ids, fnames):
+        """تحديث الكاش وإعادة حساب الإجماليات والرصيد بعد التعديل المباشر"""
+        treasuries = self.browse(treasury_ids)
+        treasuries.invalidate_recordset(fnames)
+        treasuries.modified(fnames)
+    
+    def _reconcile_totals(self):
+        """إعادة حساب الأرصدة الجارية من الصفر باستعلام تجميعي واحد لكل (فرع، يوم)"""
+        if not self:
+            return
+        self.env['brandat.sale'].flush_model(['store_id', 'date', 'state', 'amount_total'])
+        self.env['brandat.purchase'].flush_model(['store_id', 'date', 'state', 'amount_total'])
+        self.env['brandat.transaction'].flush_model(['treasury_id', 'state', 'transaction_type', 'amount'])
+        self.flush_recordset(['store_id', 'date'])
+        
+        self.env.cr.execute("""
+            WITH treasury AS (
+                SELECT id, store_id, date FROM brandat_treasury WHERE id IN %(ids)s
+            ),
+            store_days AS (
+                SELECT DISTINCT store_id, date FROM treasury
+            ),
+            sales AS (
+                SELECT k.store_id, k.date, SUM(s.amount_total) AS total
+                FROM store_days k
+                JOIN brandat_sale s ON s.store_id = k.store_id
+                    AND s.date >= k.date AND s.date < k.date + 1
+                WHERE s.state = 'confirmed'
+                GROUP BY k.store_id, k.date
+            ),
+            purchases AS (
+                SELECT k.store_id, k.date, SUM(p.amount_total) AS total
+                FROM store_days k
+                JOIN brandat_purchase p ON p.store_id = k.store_id
+                    AND p.date >= k.date AND p.date < k.date + 1
+                WHERE p.state = 'confirmed'
+                GROUP BY k.store_id, k.date
+            ),
+            transactions AS (
+                SELECT tr.treasury_id,
+                       SUM(tr.amount) FILTER (WHERE tr.transaction_type = 'income') AS income,
+                       SUM(tr.amount) FILTER (WHERE tr.transaction_type = 'expense') AS expense
+                FROM brandat_transaction tr
+                WHERE tr.state = 'confirmed' AND tr.treasury_id IN %(ids)s
+                GROUP BY tr.treasury_id
+            )
+            UPDATE brandat_treasury t
+            SET total_sales = COALESCE(sales.total, 0),
+                total_purchases = COALESCE(purchases.total, 0),
+                transaction_income = COALESCE(transactions.income, 0),
+                transaction_expense = COALESCE(transactions.expense, 0)
+            FROM treasury
+            LEFT JOIN sales ON sales.store_id = treasury.store_id AND sales.date = treasury.date
+            LEFT JOIN purchases ON purchases.store_id = treasury.store_id AND purchases.date = treasury.date
+            LEFT JOIN transactions ON transactions.treasury_id = treasury.id
+            WHERE t.id = treasury.id
+        """, {'ids': tuple(self.ids)})
+        self._totals_updated(self.ids, list(self.INCREMENTAL_FIELDS))
+    
+    @api.model
+    def _cron_reconcile_totals(self):
+        """مهمة التسوية: إعادة حساب الخزائن المفتوحة وخزائن آخر يومين"""
+        treasuries = self.search([
+            '|',
+            ('state', '=', 'open'),
+            ('date', '>=', fields.Date.today() - timedelta(days=1)),
+        ])
+        treasuries._reconcile_totals()
     
     @api.depends('opening_balance', 'total_income', 'total_expense')
     def _compute_closing_balance(self):
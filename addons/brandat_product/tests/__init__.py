@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+from . import test_invoice_pdf_cache
+from . import test_stock_engine
+from . import test_sale_return
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestInvoicePdfCache(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.store = cls.env['brandat.store'].create({'name': 'الفرع الرئيسي'})
+        cls.customer = cls.env['brandat.customer'].create({'name': 'عميل'})
+        cls.product = cls.env['brandat.product'].create({'name': 'قميص', 'price': 100.0})
+        cls.size = cls.env['brandat.size'].create({'name': 'M'})
+        cls.color = cls.env['brandat.color'].create({'name': 'أحمر'})
+        cls.sale = cls.env['brandat.sale'].create({
+            'store_id': cls.store.id,
+            'customer_id': cls.customer.id,
+            'line_ids': [(0, 0, {
+                'product_id': cls.product.id,
+                'size_id': cls.size.id,
+                'color_id': cls.color.id,
+                'quantity': 1,
+                'price_unit': 100.0,
+            })],
+        })
+
+    def test_cache_hit_after_edit_and_rerender(self):
+        self.sale._render_invoice_pdf()
+        attachment = self.sale._get_cached_invoice_pdf()
+        self.assertTrue(attachment)
+
+        # حفظ البصمة نفسه يغير write_date ولا يجب أن يبطل الملف
+        self.env.flush_all()
+        self.assertEqual(self.sale._get_cached_invoice_pdf(), attachment)
+
+        self.sale.line_ids.quantity = 2
+        self.assertFalse(self.sale._get_cached_invoice_pdf())
+
+        self.sale._render_invoice_pdf()
+        self.assertEqual(self.sale._get_cached_invoice_pdf(), attachment)
+
+        self.sale.notes = 'ملاحظة'
+        self.sale._render_invoice_pdf()
+        self.env.flush_all()
+        self.assertEqual(self.sale._get_cached_invoice_pdf(), attachment)
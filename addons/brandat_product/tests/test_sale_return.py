@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from odoo.exceptions import ValidationError
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestSaleReturnQuantities(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.store = cls.env['brandat.store'].create({'name': 'الفرع الرئيسي'})
+        cls.product = cls.env['brandat.product'].create({'name': 'قميص', 'price': 100.0})
+        cls.size = cls.env['brandat.size'].create({'name': 'M'})
+        cls.color = cls.env['brandat.color'].create({'name': 'أحمر'})
+        cls.env['brandat.stock']._apply_stock_moves(
+            [(cls.store.id, cls.product.id, cls.size.id, cls.color.id, 10)], move_type='purchase')
+        cls.sale = cls.env['brandat.sale'].create({
+            'store_id': cls.store.id,
+            'line_ids': [(0, 0, {
+                'product_id': cls.product.id,
+                'size_id': cls.size.id,
+                'color_id': cls.color.id,
+                'quantity': 2,
+                'price_unit': 100.0,
+            })],
+        })
+        cls.sale.action_confirm()
+        cls.sale_line = cls.sale.line_ids
+
+    def _create_return(self, quantity):
+        return self.env['brandat.sale.return'].create({
+            'sale_id': self.sale.id,
+            'reason': 'wrong_size',
+            'line_ids': [(0, 0, {
+                'sale_line_id': self.sale_line.id,
+                'product_id': self.product.id,
+                'size_id': self.size.id,
+                'color_id': self.color.id,
+                'quantity_sold': self.sale_line.quantity,
+                'quantity_return': quantity,
+                'price_unit': self.sale_line.price_unit,
+            })],
+        })
+
+    def test_returnable_quantity_follows_approved_returns(self):
+        self.assertEqual(self.sale_line.quantity_returnable, 2)
+        first = self._create_return(1)
+        first.action_approve()
+        self.assertEqual(self.sale_line.quantity_returned, 1)
+        self.assertEqual(self.sale_line.quantity_returnable, 1)
+
+        first.action_complete()
+        self.assertEqual(self.sale_line.quantity_returnable, 1)
+        self.assertEqual(self.sale.returned_quantity, 1)
+
+    def test_cannot_return_more_than_remaining(self):
+        self._create_return(2).action_approve()
+        second = self._create_return(1)
+        with self.assertRaises(ValidationError):
+            second.action_approve()
+        self.assertEqual(self.sale_line.quantity_returnable, 0)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from odoo import fields
+from odoo.exceptions import ValidationError
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestStockEngine(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Stock = cls.env['brandat.stock']
+        cls.store_a = cls.env['brandat.store'].create({'name': 'فرع أ'})
+        cls.store_b = cls.env['brandat.store'].create({'name': 'فرع ب'})
+        cls.product = cls.env['brandat.product'].create({'name': 'قميص', 'price': 100.0})
+        cls.size = cls.env['brandat.size'].create({'name': 'M'})
+        cls.color = cls.env['brandat.color'].create({'name': 'أحمر'})
+        cls.key_a = (cls.store_a.id, cls.product.id, cls.size.id, cls.color.id)
+        cls.key_b = (cls.store_b.id, cls.product.id, cls.size.id, cls.color.id)
+
+    def _quantity(self, key):
+        return self.Stock._get_available_qty_map([key]).get(key, 0)
+
+    def _ledger(self):
+        return self.env['brandat.stock.move'].get_stock_at(
+            fields.Datetime.now() + timedelta(minutes=1), product_ids=self.product.ids)
+
+    def test_receipt_creates_row_and_records_move(self):
+        self.Stock._apply_stock_moves([self.key_a + (5,), self.key_a + (3,)], move_type='purchase')
+        self.assertEqual(self._quantity(self.key_a), 8)
+        self.assertEqual(self.Stock.search_count([
+            ('store_id', '=', self.store_a.id), ('product_id', '=', self.product.id)]), 1)
+        self.assertEqual(self._ledger(), {self.key_a: 8})
+
+    def test_shortage_raises_and_changes_nothing(self):
+        self.Stock._apply_stock_moves([self.key_a + (2,)], move_type='purchase')
+        with self.assertRaises(ValidationError):
+            self.Stock._apply_stock_moves([self.key_a + (-3,)], move_type='sale')
+        self.assertEqual(self._quantity(self.key_a), 2)
+
+    def test_transfer_moves_between_stores(self):
+        self.Stock._apply_stock_moves([self.key_a + (10,)], move_type='purchase')
+        self.Stock._apply_stock_moves([self.key_a + (-4,), self.key_b + (4,)], move_type='adjust')
+        self.assertEqual(self._quantity(self.key_a), 6)
+        self.assertEqual(self._quantity(self.key_b), 4)
+        self.assertEqual(self._ledger(), {self.key_a: 6, self.key_b: 4})
+
+    def test_direct_edit_is_recorded_in_ledger(self):
+        stock = self.Stock.create({
+            'store_id': self.store_a.id,
+            'product_id': self.product.id,
+            'size_id': self.size.id,
+            'color_id': self.color.id,
+            'quantity': 7,
+        })
+        stock.quantity = 3
+        self.env.flush_all()
+        self.assertEqual(self._ledger(), {self.key_a: 3})